@@ -1,21 +1,22 @@
 import time
-import pprint
 import shutil
 import json
 import re
 import os
 import sys
+import stat
+import glob
+import hashlib
+import tempfile
 import traceback
-try:
-    import SimpleHTTPServer as httpserver
-    import SocketServer as socketserver
-except ImportError:
-    import http.server as httpserver
-    import socketserver
 import argparse
 import logging
 import fnmatch
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+
+import six
+
+from .cache import Cache
 
 
 logger = logging.getLogger(__name__)
@@ -25,6 +26,60 @@ class NotRequirableError(Exception):
     pass
 
 
+def parse_shard(value):
+    """\
+    Parse a shard given as "i/N": the i-th (counting from 1) of N shards.
+
+    Returns a tuple of (i, N), or None if value is empty.
+
+    Arguments:
+    value - The shard, as a string.
+    """
+    if not value:
+        return None
+    match = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError("Invalid shard {!r}, expected i/N with 1 <= i <= N".format(value))
+    return int(match.group(1)), int(match.group(2))
+
+
+def map_threads(function, items, threads=1):
+    """\
+    Call a function for each item, in a pool of threads, for overlapping I/O.
+
+    Returns a list of the results, in the order of the items.  If any call raises an exception, the exception raised by
+    the first item (in order) to fail is raised once every call has finished, so errors are reported the same way
+    however the calls are scheduled.
+
+    Arguments:
+    function - The function to call, with each item.
+    items - The items.
+    threads - Maximum number of threads.  1 calls the function for each item in turn, in this thread.
+    """
+    items = list(items)
+    if not threads or threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    def call(item):
+        try:
+            return True, function(item)
+        except Exception:
+            return False, sys.exc_info()
+
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(min(threads, len(items)))
+    try:
+        results = pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+    for success, result in results:
+        if not success:
+            six.reraise(*result)
+    return [result for _, result in results]
+
+
 class InDirectory(object):
     def __init__(self, directory, root=None):
         self.original_directory = None
@@ -43,6 +98,67 @@ class InDirectory(object):
             os.chdir(self.original_directory)
 
 
+class FileStat(namedtuple('FileStat', ['size', 'mtime', 'mtime_ns', 'inode'])):
+    """\
+    The size, modification time and inode of a file, as recorded in its file_data ("_stat") when the file list is built.
+
+    Plugins should use Plugin.stat() rather than calling os.stat() or os.path.getmtime() again, so every plugin sees the
+    same snapshot of the source files for the whole build.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_stat(cls, st):
+        """\
+        Create a new FileStat from the result of os.stat().
+
+        Arguments:
+        st - os.stat_result instance.
+        """
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1000000000)
+        return cls(st.st_size, st.st_mtime, mtime_ns, st.st_ino)
+
+
+class FileList(OrderedDict):
+    """\
+    The file list: an ordered dictionary that counts changes to its keys.
+
+    Any file being added, replaced or removed increments the version, so results computed from the file list can tell
+    when they are out of date.  Changes made within a file's file_data are not counted.
+    """
+    version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        self._changed()
+        OrderedDict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._changed()
+        OrderedDict.__delitem__(self, key)
+
+    def pop(self, *args):
+        self._changed()
+        return OrderedDict.pop(self, *args)
+
+    def popitem(self, *args, **kwargs):
+        self._changed()
+        return OrderedDict.popitem(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        self._changed()
+        OrderedDict.clear(self)
+
+
 class Breeze(object):
     def __init__(self):
         self._reset()
@@ -50,10 +166,18 @@ class Breeze(object):
         self.once_plugins = []
         self.debuglevel = logging.ERROR
         self.root_directory = None
+        self.cache = None
+        self.shard = None
+        self.only = []
+        self._argv = None
+        self._source_fingerprint = None
+        self._output_digests = {}
 
     def _reset(self):
         self.context = {}
-        self.files = OrderedDict()
+        self.files = FileList()
+        self._filelist_cache = {}
+        self._filelist_version = None
 
     @classmethod
     def _compare(self, key, op, invert, test, data):
@@ -110,9 +234,34 @@ class Breeze(object):
 
             yield (filename, file_data)
 
+    def memoized_filelist(self, pattern=None, **kwargs):
+        """\
+        Get a list of files, as filelist() does, reusing the result of earlier calls with the same arguments.
+
+        Results are kept until the next plugin is run, or until a file is added to or removed from the file list, and
+        the same list is returned each time, so it must not be modified.  This is what templates see as "filelist".
+
+        Arguments:
+        pattern - Files to include, as accepted by fnmatch.  Defaults to all files.
+        **kwargs - Tests on file_data, as accepted by filelist().
+        """
+        try:
+            key = (pattern, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return list(self.filelist(pattern, **kwargs))
+
+        version = (id(self.files), getattr(self.files, 'version', None))
+        if version != self._filelist_version:
+            self._filelist_cache = {}
+            self._filelist_version = version
+        if key not in self._filelist_cache:
+            self._filelist_cache[key] = list(self.filelist(pattern, **kwargs))
+        return self._filelist_cache[key]
+
     def run(self, args=None, exit=True):
         parser = argparse.ArgumentParser(description="Breeze CLI utility")
-        parser.add_argument('command', metavar='command', help="Command to run", choices=['run', 'build'])
+        parser.add_argument('command', metavar='command', help="Command to run", choices=['run', 'build', 'watch', 'compile', 'merge', 'cache-export', 'cache-import'])
         parser.add_argument('-c', '--config', help='Configuration file to load from', default='config.json')
         parser.add_argument('-i', '--include', help='Include files and directories matching this pattern, recursively', action='append', default=None)
         parser.add_argument('-x', '--exclude', help='Exclude files and directories matching this pattern, recursively', action='append', default=None)
@@ -123,6 +272,17 @@ class Breeze(object):
         parser.add_argument('-p', '--port', help='For the run command, run on this port', type=int, default=None)
         parser.add_argument('-D', '--debug', help='Debug level', action='count', default=None)
         parser.add_argument('--build-interval', help='When using the run command, don\'t build more frequently than this (seconds)', default=None)
+        parser.add_argument('--watch-interval', help='When using the watch command, check for changes this often (seconds)', type=float, default=None)
+        parser.add_argument('--watch-debounce', help='When using the watch command, wait for changes to stop for this long before building (seconds)', type=float, default=None)
+        parser.add_argument('--cache-directory', help='Keep caches that persist between builds in this directory', default=None)
+        parser.add_argument('--cache-size', help='Maximum size of the build cache (bytes)', type=int, default=None)
+        parser.add_argument('--cache-remote', help='Also read from and write to the build cache in this (shared) directory', default=None)
+        parser.add_argument('--cache-archive', help='For the cache-export and cache-import commands, the archive to write or read', default=None)
+        parser.add_argument('--only', help='For the build command, build only the output files whose destination matches this pattern, leaving the rest of the destination untouched', action='append', default=None)
+        parser.add_argument('--shard', help='For the build command, build only this shard of the output, given as i/N', default=None)
+        parser.add_argument('--shards', help='For the build command, build the output in this many shards in parallel, then merge them', type=int, default=None)
+        parser.add_argument('--io-threads', help='Read and write up to this many files at a time', type=int, default=None)
+        parser.add_argument('--shard-directory', help='Put the output of each shard into this directory, to be merged', default=None)
 
         self.config = {
             'include': ['*'],
@@ -134,6 +294,18 @@ class Breeze(object):
             'port': 8000,
             'debug': 0,
             'build_interval': 2,
+            'watch_interval': 0.5,
+            'watch_debounce': 0.2,
+            'cache_directory': './.breeze_cache',
+            'cache_size': 256 * 1024 * 1024,
+            'cache_remote': None,
+            'cache_archive': './breeze-cache.tar.gz',
+            'only': [],
+            'shard': None,
+            'shards': None,
+            'shard_directory': './_shards',
+            'io_threads': 8,
+            'plugins': [],
         }
 
         args = args or sys.argv
@@ -144,6 +316,7 @@ class Breeze(object):
 
         self.root_directory = os.path.abspath(os.path.dirname(args[0]))
         bin_file = os.path.relpath(os.path.abspath(args[0]), self.root_directory)
+        self._argv = [os.path.abspath(args[0])] + list(args[1:])
 
         with InDirectory(self.root_directory):
             retcode = 0
@@ -153,10 +326,24 @@ class Breeze(object):
 
                 self.config.update({k: v for k, v in vars(opts).items() if v is not None})
                 self.config['exclude'] += [self.config['config'], bin_file, self.config['destination']]
+                for key in ('cache_directory', 'cache_archive', 'cache_remote', 'shard_directory'):
+                    if self.config[key]:
+                        self.config['exclude'].append(self.config[key])
+                self.shard = parse_shard(self.config['shard'])
+                self.only = self.config['only']
+                if self.only and (self.shard or self.config['shards']):
+                    raise ValueError("A build may not be both partial (--only) and sharded")
+                self.configure_plugins(self.config['plugins'])
                 for key in ('include', 'exclude'):
                     self.config[key] = [os.path.realpath(os.path.abspath(v)) for v in self.config[key]]
+                if self.config['cache_directory']:
+                    self.cache = Cache(
+                        os.path.join(self.config['cache_directory'], 'objects'),
+                        self.config['cache_size'],
+                        self.config['cache_remote'],
+                    )
 
-                cmd = getattr(self, '_command_' + re.sub(r'[^\w]', '', args[1].lower()))
+                cmd = getattr(self, '_command_' + re.sub(r'[^\w]', '_', args[1].lower()))
 
                 retcode = cmd() or 0
             except Exception as e:
@@ -171,6 +358,13 @@ class Breeze(object):
         return retcode
 
     def _command_run(self):
+        try:
+            import SimpleHTTPServer as httpserver
+            import SocketServer as socketserver
+        except ImportError:
+            import http.server as httpserver
+            import socketserver
+
         try:
             logger.warning("This development server is for debugging purposes only and not intended to serve real traffic.")
             logger.info("Running development server on http://localhost:%d/", self.config['port'])
@@ -205,9 +399,12 @@ class Breeze(object):
             logger.debug("Exiting due to ctrl+c")
 
     def _command_build(self):
+        if self.config.get('shards') and self.shard is None:
+            return self.build_shards(self.config['shards'])
         self._reset()
         with InDirectory(self.root_directory):
             self.build_filelist()
+            self._source_fingerprint = self.source_fingerprint()
             self.run_plugins()
             # if self.debuglevel == logging.DEBUG:
             #     print "--- FILES ---"
@@ -216,9 +413,282 @@ class Breeze(object):
             #     print "--- CONTEXT ---"
             #     pprint.pprint(dict(self.context), indent=4)
             #     print
-            self.write_output()
+            written, _ = self.write_output()
+            self.prune_cache()
+        if self.only:
+            logger.info("Partial build of %s: %d files written", ', '.join(self.only), written)
 
-    def build_filelist(self):
+    def _command_watch(self):
+        from .plugins.templates import Jinja2
+
+        renderers = [plugin for plugin in self.plugins if isinstance(plugin, Jinja2)]
+
+        def summary(names):
+            return ', '.join(names[:10]) + (' and %d more' % (len(names) - 10) if len(names) > 10 else '')
+
+        def build():
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error("Build failed, the destination is unchanged: %s: %s", e.__class__.__name__, str(e), exc_info=True)
+
+        try:
+            with InDirectory(self.root_directory):
+                snapshot = self.source_snapshot()
+            build()
+            logger.info("Watching for changes")
+            while True:
+                time.sleep(self.config['watch_interval'])
+                with InDirectory(self.root_directory):
+                    current = self.source_snapshot()
+                    if current == snapshot:
+                        continue
+                    # Wait for a burst of changes (such as a checkout, or an editor saving) to finish
+                    while True:
+                        time.sleep(self.config['watch_debounce'])
+                        settled = self.source_snapshot()
+                        if settled == current:
+                            break
+                        current = settled
+                changed = sorted(k for k in set(snapshot) | set(current) if snapshot.get(k) != current.get(k))
+                logger.info("Changed: %s", summary(changed))
+                dependents = sorted(set(
+                    filename
+                    for plugin in renderers
+                    for filename in plugin.dependents(changed)
+                    if filename not in changed
+                ))
+                if dependents:
+                    logger.info("Using changed templates: %s", summary(dependents))
+                snapshot = current
+                build()
+        except KeyboardInterrupt:
+            logger.debug("Exiting due to ctrl+c")
+
+    def source_snapshot(self):
+        """\
+        Get the size, modification time and inode of every file in the source directory, to detect changes.
+
+        Files excluded by name ("exclude_files") are included, as plugins may still read them, like Sass partials.
+
+        Returns a dictionary of FileStat instances (or None, for files that could not be stat()ed) by filename.
+        """
+        return {
+            filename: FileStat.from_stat(file_stat) if file_stat is not None else None
+            for filename, file_stat in self._source_files(exclude_files=False)
+        }
+
+    def rebuild(self):
+        """\
+        Build the site, updating the destination incrementally rather than replacing it (see write_output()).
+
+        Plugins reuse their work for unchanged inputs through the build cache (and Jinja2's incremental mode, if
+        enabled), and only outputs that changed are written.  If any plugin fails, the destination is not touched.  The
+        time taken by each stage is logged.
+
+        Returns a dictionary of the time taken by each stage, in seconds.
+        """
+        timings = OrderedDict()
+        start = stage = time.time()
+        self._reset()
+        with InDirectory(self.root_directory):
+            self.build_filelist()
+            timings['files'], stage = time.time() - stage, time.time()
+            self.run_plugins()
+            timings['plugins'], stage = time.time() - stage, time.time()
+            written, removed = self.write_output(incremental=True)
+            timings['write'], stage = time.time() - stage, time.time()
+            self.prune_cache()
+        timings['total'] = time.time() - start
+        logger.info(
+            "Built in %.3fs (%s): %d files written, %d removed",
+            timings['total'],
+            ', '.join('{} {:.3f}s'.format(name, value) for name, value in timings.items() if name != 'total'),
+            written,
+            removed,
+        )
+        return timings
+
+    def _command_compile(self):
+        self._reset()
+        compilers = [plugin for plugin in self.plugins if hasattr(plugin, 'compile_templates')]
+        if not compilers:
+            logger.warning("No plugins have templates to compile")
+            return
+        with InDirectory(self.root_directory):
+            self.build_filelist()
+            # Run the plugins that come before, so the templates are compiled as they would be rendered
+            self.run_plugins(self.plugins[:self.plugins.index(compilers[-1]) + 1], compile=True)
+            self.prune_cache()
+
+    def _command_merge(self):
+        with InDirectory(self.root_directory):
+            self.merge_shards()
+
+    def build_shards(self, count):
+        """\
+        Build the site in several shards, each in its own process, then merge them into the destination directory.
+
+        Each process runs this script again with the same arguments, adding "--shard i/N".
+
+        Arguments:
+        count - Number of shards.
+        """
+        import subprocess
+
+        with InDirectory(self.root_directory):
+            if os.path.exists(self.config['shard_directory']):
+                shutil.rmtree(self.config['shard_directory'])
+        processes = [
+            subprocess.Popen(
+                [sys.executable] + self._argv + ['--shard', '{}/{}'.format(index, count)],
+                cwd=self.root_directory,
+            )
+            for index in range(1, count + 1)
+        ]
+        failed = [str(index) for index, process in enumerate(processes, 1) if process.wait() != 0]
+        if failed:
+            raise ValueError("Shards failed to build: " + ', '.join(failed))
+        with InDirectory(self.root_directory):
+            self.merge_shards()
+
+    def in_shard(self, filename):
+        """\
+        Check whether a file belongs to the shard being built.
+
+        Files are assigned to shards by a hash of their name, or of their "shard_key" attribute if they have one (so a
+        file derived from another may be kept in the same shard).  Every file belongs to an unsharded build.
+
+        Arguments:
+        filename - Key of the file list.
+        """
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        key = (self.files.get(filename) or {}).get('shard_key', filename)
+        return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % count == index - 1
+
+    def selected(self, filename):
+        """\
+        Check whether a file is part of the output being built.
+
+        In a partial build ("build --only"), only files whose destination matches one of the given patterns are selected,
+        along with the files derived from them (those with a "shard_key" naming a selected file, such as compressed
+        copies); in a sharded build, only files in the shard (see in_shard()).  Otherwise, every file is selected.
+        Plugins may skip rendering files that are not selected, and only selected files are written.
+
+        Arguments:
+        filename - Key of the file list.
+        """
+        if self.only:
+            def matches(name):
+                destination = (self.files.get(name) or {}).get('destination', name)
+                destination = os.path.normpath(destination).replace(os.sep, '/')
+                return any(fnmatch.fnmatch(destination, pattern) for pattern in self.only)
+
+            shard_key = (self.files.get(filename) or {}).get('shard_key')
+            if not matches(filename) and not (shard_key and shard_key != filename and matches(shard_key)):
+                return False
+        return self.in_shard(filename)
+
+    def source_fingerprint(self):
+        """\
+        Get a hash of the names and sizes of the files in the file list, to check that shards were built from the same
+        source.
+        """
+        digest = hashlib.sha1()
+        for filename in sorted(self.files.keys()):
+            file_stat = self.files[filename].get('_stat')
+            digest.update('{}:{}\n'.format(filename, file_stat.size if file_stat else None).encode('utf-8'))
+        return digest.hexdigest()
+
+    def shard_destination(self, index):
+        """\
+        Get the directory the output of a shard is written to.  Its manifest is written alongside, with ".json" added.
+
+        Arguments:
+        index - Number of the shard, counting from 1.
+        """
+        return os.path.join(self.config['shard_directory'], str(index))
+
+    def merge_shards(self):
+        """\
+        Assemble the output of every shard into the destination directory.
+
+        The shards' manifests must agree on the number of shards and the source they were built from, every shard must be
+        present, no file may be written by more than one shard, and every file must match its recorded hash; otherwise
+        ValueError is raised and the destination is left untouched.
+
+        Plugins may combine what each shard saved to the cache directory, by defining merge_shards(breeze_instance,
+        count); it is called once the output has been merged.
+        """
+        manifests = {}
+        for filename in glob.glob(os.path.join(self.config['shard_directory'], '*.json')):
+            with open(filename, 'r') as fp:
+                manifest = json.load(fp)
+            manifests[manifest['shard']] = manifest
+        if not manifests:
+            raise ValueError("There are no shards to merge in " + self.config['shard_directory'])
+
+        first = manifests[min(manifests)]
+        if any((m['shards'], m['source']) != (first['shards'], first['source']) for m in manifests.values()):
+            raise ValueError("The shards were not built from the same source and number of shards")
+        missing = sorted(set(range(1, first['shards'] + 1)) - set(manifests))
+        if missing:
+            raise ValueError("Missing shards: " + ', '.join(str(index) for index in missing))
+
+        outputs = {}
+        for index, manifest in sorted(manifests.items()):
+            for name, digest in sorted(manifest['outputs'].items()):
+                if name in outputs:
+                    raise ValueError("{} was written by shards {} and {}".format(name, outputs[name][0], index))
+                path = os.path.join(self.shard_destination(index), name)
+                try:
+                    with open(path, 'rb') as fp:
+                        valid = hashlib.sha1(fp.read()).hexdigest() == digest
+                except IOError:
+                    valid = False
+                if not valid:
+                    raise ValueError("{} is missing or corrupt in shard {}".format(name, index))
+                outputs[name] = (index, path)
+
+        try:
+            shutil.rmtree(self.config['destination'])
+        except OSError:
+            if os.path.exists(self.config['destination']):
+                raise
+        for name, (_, path) in sorted(outputs.items()):
+            filename = os.path.join(self.config['destination'], name)
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            shutil.copyfile(path, filename)
+        for plugin in self.plugins:
+            merge = getattr(plugin, 'merge_shards', None)
+            if merge is not None:
+                merge(self, first['shards'])
+        logger.info("Merged %d files from %d shards", len(outputs), len(manifests))
+
+    def _command_cache_export(self):
+        if self.cache is None:
+            raise ValueError("Exporting the cache requires a cache directory")
+        with InDirectory(self.root_directory):
+            count = self.cache.export(self.config['cache_archive'])
+        logger.info("Exported %d cache entries to %s", count, self.config['cache_archive'])
+
+    def _command_cache_import(self):
+        if self.cache is None:
+            raise ValueError("Importing the cache requires a cache directory")
+        with InDirectory(self.root_directory):
+            count = self.cache.import_archive(self.config['cache_archive'])
+            self.prune_cache()
+        logger.info("Imported %d cache entries from %s", count, self.config['cache_archive'])
+
+    def prune_cache(self):
+        if self.cache is not None:
+            self.cache.prune()
+            logger.info("Cache: %s", self.cache.summary())
+
+    def _source_files(self, exclude_files=True):
         queue = [self.config['source']]
         while queue:
             cur_dir = queue.pop()
@@ -240,7 +710,7 @@ class Breeze(object):
                 # Once a file has been excluded, don't check it anymore
                 # But if it is still included, check the filename itself
                 # This time in reverse - exclude first, then include
-                if is_ok:
+                if is_ok and exclude_files:
                     filename_basename = os.path.basename(filename)
                     for pattern in self.config['exclude_files']:
                         if fnmatch.fnmatch(filename_basename, pattern):
@@ -256,11 +726,38 @@ class Breeze(object):
                 if not is_ok:
                     continue
                 # Put it in the file list, or the queue
-                if os.path.isdir(filename):
+                try:
+                    file_stat = os.stat(filename)
+                except OSError:
+                    file_stat = None
+                if file_stat is not None and stat.S_ISDIR(file_stat.st_mode):
                     queue.append(filename)
                 else:
-                    filename = os.path.relpath(filename, os.path.realpath(os.path.abspath(self.config['source'])))
-                    self.files[filename] = {'source': filename, 'destination': filename}
+                    yield os.path.relpath(filename, os.path.realpath(os.path.abspath(self.config['source']))), file_stat
+
+    def build_filelist(self):
+        for filename, file_stat in self._source_files():
+            self.files[filename] = {'source': filename, 'destination': filename}
+            if file_stat is not None:
+                self.files[filename]['_stat'] = FileStat.from_stat(file_stat)
+
+    def configure_plugins(self, plugins):
+        """\
+        Add plugins to the pipeline, as given by the "plugins" configuration option.
+
+        Each plugin is given by its name, or by an object naming it ("plugin") along with the keyword arguments to
+        construct it with, for example {"plugin": "Match", "mask": "md_pages/*"}.  They are added after any plugins
+        added in code.
+
+        Arguments:
+        plugins - List of plugins.
+        """
+        for entry in plugins:
+            if isinstance(entry, dict):
+                kwargs = dict(entry)
+                self.plugin(kwargs.pop('plugin'), **kwargs)
+            else:
+                self.plugin(entry)
 
     def _plugin_require(self, plugin):
         for sub_plugin_class in plugin.requires():
@@ -271,14 +768,29 @@ class Breeze(object):
                 )
             self.plugin(sub_plugin_class())
 
-    def plugin(self, plugin):
+    def plugin(self, plugin, *args, **kwargs):
+        """\
+        Add a plugin to the pipeline, along with any plugins it requires.
+
+        Returns this instance, so calls may be chained.
+
+        Arguments:
+        plugin - A plugin instance, a plugin class, or the name of a plugin (see breeze.plugins.plugin_registry()),
+            which is imported now.
+        *args, **kwargs - Arguments to construct the plugin with, if a class or name is given.
+        """
+        if isinstance(plugin, six.string_types):
+            # Imported here, as the plugins import this module
+            from .plugins import load_plugin
+
+            plugin = load_plugin(plugin)
         try:
             self._plugin_require(plugin)
         except NotRequirableError as e:
             raise NotRequirableError(e[0], plugin.__class__.__name__, *e[1:])
         plugin_instance = plugin
         if type(plugin_instance) is type:
-            plugin_instance = plugin_instance()
+            plugin_instance = plugin_instance(*args, **kwargs)
         if plugin_instance.run_once:
             if plugin_instance.__class__ in self.once_plugins:
                 logger.warning('Plugin "%s" may only run once', plugin_instance.__class__.__name__)
@@ -287,34 +799,129 @@ class Breeze(object):
         self.plugins.append(plugin_instance)
         return self
 
-    def run_plugins(self):
-        for plugin in self.plugins:
+    def run_plugins(self, plugins=None, compile=False):
+        plugins = self.plugins if plugins is None else plugins
+        for plugin in plugins:
+            prepare = getattr(plugin, 'prepare', None)
+            if prepare is not None:
+                prepare(self)
+        for plugin in plugins:
+            self._filelist_cache = {}
+            if compile and hasattr(plugin, 'compile_templates'):
+                logger.info("Compiled %d templates", len(plugin.compile_templates(self)))
+                continue
             out = plugin.run(self)
             if out is not None:
-                self.files = out
-
-    def write_output(self):
-        files = {os.path.join(self.config['destination'], v['destination']): v for v in self.files.values()}
+                # Keep counting changes to the file list, for memoized_filelist()
+                self.files = out if isinstance(out, FileList) else FileList(out)
+
+    def write_output(self, incremental=False):
+        """\
+        Write the files in the file list to the destination directory (or the shard's directory, in a sharded build).
+
+        By default, the destination is removed and written again from scratch.  Incrementally, only files whose
+        contents differ from those already in the destination are written, each to a temporary file which then replaces
+        the old one, and files no longer in the output are removed once everything else is written; so the destination
+        never holds a partly written file, and is not touched at all if nothing changed.
+
+        In a partial build (see selected()), only the selected files are written, as they are incrementally, and nothing
+        else in the destination is touched.
+
+        Returns a tuple of the number of files written and the number removed.
+
+        Arguments:
+        incremental - If true, update the destination rather than replacing it.
+        """
+        destination = self.config['destination']
+        if self.shard is not None:
+            destination = self.shard_destination(self.shard[0])
+        files = {os.path.join(destination, v['destination']): (k, v) for k, v in self.files.items()}
+        files = {k: v for k, (filename, v) in files.items() if self.selected(filename)}
         dirs = set([os.path.dirname(k) for k, v in files.items() if not v.get('skip_write')])
+        outputs = {}
+        partial = bool(self.only)
+        incremental = incremental or partial
 
-        try:
-            shutil.rmtree(self.config['destination'])
-        except OSError:
-            if os.path.exists(self.config['destination']):
-                raise
+        if not incremental:
+            try:
+                shutil.rmtree(destination)
+            except OSError:
+                if os.path.exists(destination):
+                    raise
 
         for dirname in dirs:
             if not os.path.exists(dirname):
                 os.makedirs(dirname)
 
-        for filename, file_data in files.items():
-            if file_data.get('skip_write'):
-                continue
-            with open(filename, 'wb') as out_fp:
-                contents = None
-                if file_data.get('_contents') is not None:
-                    if file_data.get('_mimetype') and file_data.get('_mimetype').startswith('text/'):
-                        contents = file_data['_contents'].encode('utf-8')
-                    else:
-                        contents = file_data['_contents']
-                out_fp.write(contents)
+        umask = os.umask(0)
+        os.umask(umask)
+
+        def write(item):
+            filename, file_data = item
+            contents = None
+            if file_data.get('_contents') is not None:
+                if file_data.get('_mimetype') and file_data.get('_mimetype').startswith('text/'):
+                    contents = file_data['_contents'].encode('utf-8')
+                else:
+                    contents = file_data['_contents']
+            digest = None
+            if self.shard is not None or incremental:
+                digest = hashlib.sha1(contents).hexdigest()
+
+            if not incremental:
+                with open(filename, 'wb') as out_fp:
+                    out_fp.write(contents)
+                return digest, True
+
+            if self._output_digests.get(filename) == digest and os.path.exists(filename):
+                return digest, False
+            try:
+                with open(filename, 'rb') as fp:
+                    if fp.read() == contents:
+                        return digest, False
+            except IOError:
+                pass
+            fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(filename))
+            try:
+                with os.fdopen(fd, 'wb') as out_fp:
+                    out_fp.write(contents)
+                os.chmod(tmp, 0o666 & ~umask)
+                getattr(os, 'replace', os.rename)(tmp, filename)
+            except Exception:
+                os.unlink(tmp)
+                raise
+            return digest, True
+
+        files = [(filename, file_data) for filename, file_data in sorted(files.items()) if not file_data.get('skip_write')]
+        results = map_threads(write, files, self.config.get('io_threads', 1))
+        written = sum(1 for _, changed in results if changed)
+        if incremental:
+            self._output_digests = {filename: digest for (filename, _), (digest, _) in zip(files, results)}
+        if self.shard is not None:
+            for (filename, _), (digest, _) in zip(files, results):
+                outputs[os.path.relpath(filename, destination)] = digest
+
+        removed = 0
+        if incremental and not partial:
+            keep = set(os.path.normpath(filename) for filename, _ in files)
+            for dirpath, dirnames, filenames in os.walk(destination, topdown=False):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if os.path.normpath(path) not in keep:
+                        os.unlink(path)
+                        removed += 1
+                if dirpath != destination and not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+
+        if self.shard is not None:
+            if not os.path.exists(destination):
+                os.makedirs(destination)
+            with open(destination + '.json', 'w') as fp:
+                json.dump({
+                    'shard': self.shard[0],
+                    'shards': self.shard[1],
+                    'source': self._source_fingerprint,
+                    'outputs': outputs,
+                }, fp, indent=1, sort_keys=True)
+
+        return written, removed
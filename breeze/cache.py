@@ -0,0 +1,383 @@
+import os
+import re
+import time
+import errno
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import six
+
+
+logger = logging.getLogger(__name__)
+
+_ENTRY_NAME = re.compile(r'^[\w-]+$')
+
+# Maximum size of the in-memory cache used when there is no cache directory (see memory_cache()), in bytes
+MEMORY_CACHE_SIZE = 64 * 1024 * 1024
+
+
+def _fingerprint_update(digest, value):
+    # Mappings are recognized by their type, as objects such as LazyData look up any attribute on their value
+    if isinstance(value, dict) or (hasattr(type(value), 'keys') and hasattr(type(value), '__getitem__')):
+        digest.update(b'{')
+        for key in sorted(set(value.keys()), key=repr):
+            if key in value:
+                _fingerprint_update(digest, key)
+                _fingerprint_update(digest, value[key])
+        digest.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            _fingerprint_update(digest, item)
+        digest.update(b']')
+    elif isinstance(value, (six.text_type, six.binary_type)):
+        data = value.encode('utf-8') if isinstance(value, six.text_type) else value
+        digest.update(('{}:{}:'.format(type(value).__name__, len(data))).encode('ascii'))
+        digest.update(data)
+    elif getattr(type(value), '_fingerprint', None) is not None:
+        _fingerprint_update(digest, value._fingerprint())
+    elif callable(value) and hasattr(value, '__name__'):
+        name = getattr(value, '__qualname__', value.__name__)
+        digest.update(('<{}.{}>'.format(getattr(value, '__module__', None), name)).encode('utf-8'))
+    else:
+        digest.update(repr(value).encode('utf-8'))
+
+
+def fingerprint(*values):
+    """\
+    Get a hash identifying some data, for use in cache keys.
+
+    Dictionaries (and other mappings, such as MergedDict), lists, tuples and strings are hashed by their contents,
+    callables by their name, objects defining _fingerprint() by the value it returns, and anything else by its repr().
+    Dictionary order is not significant.
+
+    Arguments:
+    *values - The data to hash.
+    """
+    digest = hashlib.sha1()
+    for value in values:
+        _fingerprint_update(digest, value)
+    return digest.hexdigest()
+
+
+class Cache(object):
+    """\
+    Content-addressed cache, shared by plugins and kept between builds.
+
+    Values are stored in a namespace (usually named after the plugin) under a key identifying everything the value was
+    computed from: see key().  They are byte strings (get() and set()) or any picklable object (load() and store()).
+
+    With a directory, each value is a file named after its key, written atomically, so several processes may share the
+    cache.  Reading a value marks it as recently used, and prune() evicts the least recently used values once the cache
+    is larger than its maximum size.  Without a directory, values are kept in memory, and evicted as they are stored.
+
+    Keys do not depend on paths or modification times, so a cache directory may be moved, or copied between machines
+    with export() and import_archive().  A remote cache directory (such as a network share used by several CI runners)
+    may also be given: values not found locally are looked for there, and values stored locally are stored there too.
+
+    Values are used as they are found, and some are executable: pickled objects (see load()) and compiled Jinja2
+    templates.  Only use a remote cache, or import an archive, from a source trusted as much as the site's own code.
+    """
+
+    def __init__(self, directory=None, max_size=None, remote=None):
+        """\
+        Create a new Cache instance.
+
+        Arguments:
+        directory - Directory to keep the cache in, created if it does not exist.  Defaults to keeping it in memory.
+        max_size - Maximum total size of the values in the cache, in bytes.  Defaults to no limit.
+        remote - Directory of a cache shared with other machines, read from and written to along with this cache.  It
+            is never pruned.
+        """
+        self.directory = os.path.abspath(directory) if directory else None
+        self.max_size = max_size
+        self.remote = Cache(remote) if remote else None
+        self.stats = {}
+        self._values = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """\
+        Make a key from the things a value is computed from.
+
+        These would usually be a version number for the computation, its options, and the input itself (or a hash of
+        it).  The parts are hashed as fingerprint() does.
+
+        Arguments:
+        *parts - The things the value is computed from.
+        """
+        return fingerprint(*parts)
+
+    def _count(self, namespace, stat, amount=1):
+        with self._lock:
+            stats = self.stats.setdefault(
+                namespace,
+                {'hits': 0, 'remote_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0},
+            )
+            stats[stat] += amount
+
+    def path(self, namespace, key):
+        """\
+        Get the path of the file a value is stored in, or None if the cache is kept in memory.
+
+        Arguments:
+        namespace - Namespace of the value.
+        key - Key of the value.
+        """
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, namespace, key[:2], key)
+
+    def get(self, namespace, key):
+        """\
+        Get a value from the cache.
+
+        Returns the value as a byte string, or None if it is not in the cache.
+
+        Arguments:
+        namespace - Namespace of the value.
+        key - Key of the value.
+        """
+        value = None
+        if self.directory is None:
+            with self._lock:
+                value = self._values.pop((namespace, key), None)
+                if value is not None:
+                    self._values[(namespace, key)] = value
+        else:
+            path = self.path(namespace, key)
+            try:
+                with open(path, 'rb') as fp:
+                    value = fp.read()
+                os.utime(path, None)
+            except (IOError, OSError):
+                # Not cached, or evicted by another process
+                pass
+
+        if value is None and self.remote is not None:
+            value = self.remote.get(namespace, key)
+            if value is not None:
+                self._count(namespace, 'remote_hits')
+                self._set(namespace, key, value)
+                return value
+
+        self._count(namespace, 'misses' if value is None else 'hits')
+        return value
+
+    def set(self, namespace, key, value):
+        """\
+        Store a value in the cache.
+
+        Arguments:
+        namespace - Namespace of the value.
+        key - Key of the value.
+        value - The value, a byte string.
+        """
+        self._count(namespace, 'writes')
+        self._set(namespace, key, value)
+        if self.remote is not None:
+            try:
+                self.remote.set(namespace, key, value)
+            except (IOError, OSError) as e:
+                logger.warning("Could not write to the remote cache: %s", e)
+
+    def _set(self, namespace, key, value):
+        if self.directory is None:
+            evicted = []
+            with self._lock:
+                old = self._values.pop((namespace, key), None)
+                self._size += len(value) - (len(old) if old is not None else 0)
+                self._values[(namespace, key)] = value
+                while self.max_size is not None and self._size > self.max_size and len(self._values) > 1:
+                    (evicted_namespace, _), evicted_value = self._values.popitem(last=False)
+                    self._size -= len(evicted_value)
+                    evicted.append(evicted_namespace)
+            for evicted_namespace in evicted:
+                self._count(evicted_namespace, 'evictions')
+            return
+
+        path = self.path(namespace, key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(value)
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def load(self, namespace, key, default=None):
+        """\
+        Get an object from the cache, as stored by store().
+
+        Arguments:
+        namespace - Namespace of the object.
+        key - Key of the object.
+        default - Returned if the object is not in the cache.
+        """
+        value = self.get(namespace, key)
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def store(self, namespace, key, value):
+        """\
+        Store an object in the cache, pickled.
+
+        Arguments:
+        namespace - Namespace of the object.
+        key - Key of the object.
+        value - The object.
+        """
+        self.set(namespace, key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def entries(self):
+        """\
+        Get every value stored in the cache directory.
+
+        Returns a list of tuples of the namespace, key, path, size and last use time of each value.  Values being
+        written are not included.
+        """
+        entries = []
+        if self.directory is None or not os.path.isdir(self.directory):
+            return entries
+        for namespace in sorted(os.listdir(self.directory)):
+            for dirpath, dirnames, filenames in os.walk(os.path.join(self.directory, namespace)):
+                dirnames.sort()
+                for key in sorted(filenames):
+                    if key.startswith('.'):
+                        continue
+                    path = os.path.join(dirpath, key)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((namespace, key, path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def prune(self, max_age=3600):
+        """\
+        Evict the least recently used values until the cache is no larger than its maximum size.
+
+        Files left behind by writes that were interrupted more than max_age seconds ago are removed too.  Breeze prunes
+        its cache after each build.
+
+        Returns the number of values evicted.
+
+        Arguments:
+        max_age - Age in seconds after which unfinished writes are removed.
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return 0
+
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith('.') and filename.endswith('.tmp'):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        if now - os.stat(path).st_mtime > max_age:
+                            os.unlink(path)
+                    except OSError:
+                        pass
+
+        if self.max_size is None:
+            return 0
+        entries = self.entries()
+        size = sum(entry[3] for entry in entries)
+        evicted = 0
+        for namespace, _, path, entry_size, _ in sorted(entries, key=lambda entry: entry[4]):
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # Already evicted by another process
+                pass
+            size -= entry_size
+            evicted += 1
+            self._count(namespace, 'evictions')
+        return evicted
+
+    def export(self, path):
+        """\
+        Write every value in the cache directory to a (gzipped) tar archive, to be loaded by import_archive().
+
+        Returns the number of values written.
+
+        Arguments:
+        path - Path of the archive to create.
+        """
+        import tarfile
+
+        entries = self.entries()
+        with tarfile.open(path, 'w:gz') as tar:
+            for namespace, key, entry_path, _, _ in entries:
+                tar.add(entry_path, arcname=namespace + '/' + key, recursive=False)
+        return len(entries)
+
+    def import_archive(self, path):
+        """\
+        Load the values in an archive written by export() into this cache.
+
+        Values already in the cache are kept.  Returns the number of values loaded.  The archive must come from a trusted
+        source: see Cache.
+
+        Arguments:
+        path - Path of the archive to read.
+        """
+        import tarfile
+
+        count = 0
+        with tarfile.open(path, 'r:*') as tar:
+            for member in tar:
+                parts = member.name.split('/')
+                if not member.isfile() or len(parts) != 2 or not all(_ENTRY_NAME.match(part) for part in parts):
+                    logger.warning("Skipping unexpected cache archive member: %s", member.name)
+                    continue
+                namespace, key = parts
+                path = self.path(namespace, key)
+                if path is not None and os.path.exists(path):
+                    continue
+                self._set(namespace, key, tar.extractfile(member).read())
+                count += 1
+        return count
+
+    def summary(self):
+        """\
+        Get a one line summary of the statistics of this cache, for logging.
+        """
+        return ', '.join(
+            '{}: {hits} hits, {remote_hits} remote hits, {misses} misses, {writes} writes, {evictions} evictions'.format(
+                namespace, **stats
+            )
+            for namespace, stats in sorted(self.stats.items())
+        ) or 'unused'
+
+
+_memory_cache = None
+
+
+def memory_cache():
+    """\
+    Get the in-memory cache used by plugins when the Breeze instance has no cache.
+
+    It lasts for the lifetime of the process, and holds at most MEMORY_CACHE_SIZE bytes, evicting the least recently
+    used values beyond that.
+    """
+    global _memory_cache
+    if _memory_cache is None:
+        _memory_cache = Cache(max_size=MEMORY_CACHE_SIZE)
+    return _memory_cache
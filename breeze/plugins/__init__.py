@@ -1,7 +1,35 @@
-from .blog import *
-from .files import *
-from .parsing import *
-from .templates import *
+import sys
+import logging
+import importlib
+from collections import OrderedDict, namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+# Entry point group third-party packages register their plugins in
+ENTRY_POINT_GROUP = 'breeze.plugins'
+
+# Plugin classes are imported from their modules when first used, so that using a few plugins doesn't mean importing
+# the dependencies of all of them
+_PLUGIN_MODULES = {
+    'Blog': 'blog',
+    'Match': 'files',
+    'Contents': 'files',
+    'Weighted': 'files',
+    'Concat': 'files',
+    'Promote': 'files',
+    'Demote': 'files',
+    'Parsed': 'parsing',
+    'Data': 'parsing',
+    'Frontmatter': 'parsing',
+    'Metadata': 'parsing',
+    'Jinja2': 'templates',
+    'Markdown': 'templates',
+    'Sass': 'templates',
+    'HTML': 'templates',
+    'Minify': 'assets',
+    'Compress': 'assets',
+}
 
 
 __all__ = [
@@ -15,8 +43,121 @@ __all__ = [
     'Parsed',
     'Data',
     'Frontmatter',
+    'Metadata',
     'Jinja2',
     'Markdown',
     'Sass',
     'HTML',
+    'Minify',
+    'Compress',
 ]
+
+
+class PluginSpec(namedtuple('PluginSpec', ['name', 'module', 'attr', 'distribution', 'entry_point'])):
+    """\
+    A plugin known to the registry, which has not necessarily been imported: see plugin_registry().
+    """
+    __slots__ = ()
+
+    def load(self):
+        """\
+        Import the plugin, and return its class.
+        """
+        if self.entry_point is not None:
+            return self.entry_point.load()
+        value = importlib.import_module(self.module)
+        for part in self.attr.split('.'):
+            value = getattr(value, part)
+        return value
+
+
+def _entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return []
+        return [
+            PluginSpec(ep.name, ep.module_name, '.'.join(ep.attrs), ep.dist.project_name if ep.dist else None, ep)
+            for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+        ]
+
+    eps = entry_points()
+    eps = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, 'select') else eps.get(ENTRY_POINT_GROUP, [])
+    specs = []
+    for ep in eps:
+        module, _, attr = ep.value.partition(':')
+        distribution = getattr(getattr(ep, 'dist', None), 'name', None)
+        specs.append(PluginSpec(ep.name, module.strip(), attr.strip(), distribution, ep))
+    return specs
+
+
+_registry = None
+
+
+def plugin_registry(refresh=False):
+    """\
+    Get every plugin that may be used by name, such as in Breeze.plugin() or the "plugins" configuration option.
+
+    These are the plugins in this package, and those registered by installed packages as entry points in the
+    "breeze.plugins" group, for example in setup.py:
+
+        entry_points={'breeze.plugins': ['Thumbnails = breeze_thumbnails:Thumbnails']}
+
+    Only the names and locations of the plugins are recorded; a plugin is imported when it is loaded by load_plugin().
+    The plugins in this package take precedence over entry points of the same name.
+
+    Returns an OrderedDict of PluginSpec instances by name.
+
+    Arguments:
+    refresh - If true, discover the plugins again rather than reusing the last result.
+    """
+    global _registry
+    if _registry is None or refresh:
+        registry = OrderedDict(
+            (name, PluginSpec(name, __name__ + '.' + module, name, 'libbreeze', None))
+            for name, module in _PLUGIN_MODULES.items()
+        )
+        for spec in _entry_points():
+            if spec.name in registry:
+                if registry[spec.name].module != spec.module or registry[spec.name].attr != spec.attr:
+                    logger.warning('Ignoring plugin "%s" from %s, which is already defined', spec.name, spec.distribution)
+                continue
+            registry[spec.name] = spec
+        _registry = registry
+    return _registry
+
+
+def load_plugin(name):
+    """\
+    Import a plugin by name, and return its class.
+
+    Raises ValueError if there is no such plugin.
+
+    Arguments:
+    name - Name of the plugin, as in plugin_registry().
+    """
+    spec = plugin_registry().get(name)
+    if spec is None:
+        raise ValueError('Unknown plugin "{}", expected one of: {}'.format(name, ', '.join(sorted(plugin_registry()))))
+    return spec.load()
+
+
+def __getattr__(name):
+    if name not in _PLUGIN_MODULES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + _PLUGIN_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ is not supported (PEP 562)
+    for _name in __all__:
+        __getattr__(_name)
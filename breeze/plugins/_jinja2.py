@@ -0,0 +1,74 @@
+import os
+import json
+
+from jinja2 import BaseLoader, BytecodeCache, ModuleLoader, TemplateNotFound
+from jinja2.bccache import Bucket, bc_magic
+
+import six
+
+from .templates import _source_digest
+
+
+class FileListLoader(BaseLoader):
+    def __init__(self, filelist):
+        self.filelist = filelist
+        self.module_loader = None
+        self.compiled = {}
+
+    def _contents(self, template):
+        file_data = self.filelist.get(template)
+        if file_data is not None:
+            return file_data.get('_contents')
+        return None
+
+    def get_source(self, environment, template):
+        contents = self._contents(template)
+        if contents is not None:
+            return contents, template, lambda: self._contents(template) == contents
+
+        raise TemplateNotFound(template)
+
+    def list_templates(self):
+        return sorted(
+            filename
+            for filename, file_data in self.filelist.items()
+            if isinstance(file_data.get('_contents'), six.string_types)
+        )
+
+    def use_compiled(self, directory):
+        self.module_loader = None
+        self.compiled = {}
+        index = os.path.join(directory, 'index.json')
+        if os.path.exists(index):
+            with open(index, 'r') as fp:
+                self.compiled = json.load(fp)
+            self.module_loader = ModuleLoader(directory)
+
+    def load(self, environment, name, globals=None):
+        contents = self._contents(name)
+        if self.module_loader is not None and contents is not None:
+            if self.compiled.get(name) == _source_digest(contents):
+                template = self.module_loader.load(environment, name, globals)
+                template._uptodate = lambda: self._contents(name) == contents
+                return template
+        return BaseLoader.load(self, environment, name, globals)
+
+
+class CacheBytecodeCache(BytecodeCache):
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_bucket(self, environment, name, filename, source):
+        # Keyed by name and source rather than path, so the bytecode is reused wherever the site is built
+        checksum = self.get_source_checksum(source)
+        bucket = Bucket(environment, self.cache.key(bc_magic, name, checksum), checksum)
+        self.load_bytecode(bucket)
+        return bucket
+
+    def load_bytecode(self, bucket):
+        data = self.cache.get('jinja2', bucket.key)
+        if data is not None:
+            bucket.bytecode_from_string(data)
+
+    def dump_bytecode(self, bucket):
+        self.cache.set('jinja2', bucket.key, bucket.bytecode_to_string())
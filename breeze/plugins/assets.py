@@ -0,0 +1,407 @@
+from __future__ import unicode_literals
+
+import re
+import os
+import fnmatch
+import gzip
+import mimetypes
+import multiprocessing
+from io import BytesIO
+
+import six
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .base import Plugin
+from .files import Contents
+
+
+_JS_TOKEN = re.compile(r'''
+    (?P<ws>[ \t\f\v\r\n\u00a0\ufeff]+)
+    | (?P<linecomment>//[^\r\n]*)
+    | (?P<blockcomment>/\*.*?\*/)
+    | (?P<string>"(?:[^"\\\r\n]|\\.)*"|'(?:[^'\\\r\n]|\\.)*')
+    | (?P<word>[\w$]+)
+    | (?P<other>.)
+''', re.X | re.S | re.U)
+_JS_REGEX = re.compile(r'/(?:[^/\\\[\r\n]|\\.|\[(?:[^\]\\\r\n]|\\.)*\])+/', re.S)
+_JS_REGEX_KEYWORDS = frozenset([
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'instanceof', 'new', 'void', 'delete', 'throw', 'yield', 'await',
+])
+_JS_PAREN_KEYWORDS = frozenset(['if', 'while', 'for', 'with'])
+_JS_NEWLINE_BEFORE = ')]}\'"`+-'
+_JS_NEWLINE_AFTER = '([{\'"`+-!~'
+
+COMPRESSIBLE_MIMETYPES = [
+    'text/*',
+    'application/javascript',
+    'application/x-javascript',
+    'application/json',
+    'application/xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'image/svg+xml',
+    'image/x-icon',
+]
+
+_CSS_TOKEN = re.compile(r'''
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    | (?P<comment>/\*.*?\*/)
+    | (?P<ws>\s+)
+    | (?P<punct>[{};,>:])
+    | (?P<other>[^"'/\s{};,>:]+|.)
+''', re.X | re.S | re.U)
+
+
+def _is_word(text):
+    return text[:1].isalnum() or text[:1] in ('_', '$')
+
+
+def _scan_template(text, pos):
+    # Scan a template literal from just after its opening backtick, or the brace closing a substitution, to just after
+    # its closing backtick or the start of the next substitution ("${"), which is returned as true
+    length = len(text)
+    while pos < length:
+        char = text[pos]
+        if char == '\\':
+            pos += 2
+        elif char == '`':
+            return pos + 1, False
+        elif char == '$' and text[pos + 1:pos + 2] == '{':
+            return pos + 2, True
+        else:
+            pos += 1
+    return length, False
+
+
+def minify_js(text):
+    """\
+    Minify javascript source.
+
+    Comments (other than those starting with "/*!") and unnecessary whitespace are removed.  Newlines are kept wherever
+    automatic semicolon insertion may depend on them.  String, template and regular expression literals are kept
+    as they are.  Where a "/" might start either a regular expression or a division (after a closing brace), and the
+    two would be minified differently, the rest of the source is kept as it is.
+
+    Arguments:
+    text - Javascript source to minify.
+    """
+    out = []
+    prev = None
+    prev_kind = None
+    before_prev = None
+    pending = None
+    # Whether each open parenthesis follows "if", "while", etc., so a "/" after it closes starts a regular expression
+    parens = []
+    keyword_paren = False
+    # Depth of braces within each template substitution being minified
+    templates = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        if text[pos] == '`' or (text[pos] == '}' and templates and templates[-1] == 0):
+            if text[pos] == '}':
+                templates.pop()
+            start = pos
+            pos, substitution = _scan_template(text, pos + 1)
+            if substitution:
+                templates.append(0)
+            kind, token = 'template', text[start:pos]
+        else:
+            match = _JS_TOKEN.match(text, pos)
+            kind, token = match.lastgroup, match.group()
+            pos = match.end()
+
+        if kind in ('ws', 'linecomment') or (kind == 'blockcomment' and not token.startswith('/*!')):
+            if '\n' in token or '\r' in token:
+                pending = '\n'
+            elif pending is None:
+                pending = ' '
+            continue
+
+        if kind == 'other' and token == '/':
+            if prev is None or prev_kind == 'template':
+                regex = prev is None or prev.endswith('${')
+            elif prev_kind == 'word':
+                regex = prev in _JS_REGEX_KEYWORDS
+            elif prev_kind != 'other' or prev == ']':
+                regex = False
+            elif prev == ')':
+                regex = keyword_paren
+            elif prev in '+-':
+                # After "++" or "--" (most likely a postfix operator), but not after a binary "+" or "-"
+                regex = before_prev != prev
+            else:
+                regex = prev != '}'
+            match = _JS_REGEX.match(text, pos - 1)
+            if match and prev == '}':
+                # A block (regular expression) or an object literal or function (division): can't tell
+                if pending:
+                    out.append(pending)
+                out.append(text[pos - 1:])
+                break
+            if regex and match:
+                kind, token = 'regex', match.group()
+                pos = match.end()
+
+        if kind == 'other':
+            if token == '(':
+                parens.append(prev_kind == 'word' and prev in _JS_PAREN_KEYWORDS)
+            elif token == ')':
+                keyword_paren = parens.pop() if parens else False
+            elif token == '{' and templates:
+                templates[-1] += 1
+            elif token == '}' and templates:
+                templates[-1] -= 1
+
+        if pending and prev is not None:
+            if pending == '\n' and (_is_word(prev[-1]) or prev[-1] in _JS_NEWLINE_BEFORE) \
+                    and (_is_word(token[0]) or token[0] in _JS_NEWLINE_AFTER):
+                out.append('\n')
+            elif (_is_word(prev[-1]) and _is_word(token[0])) \
+                    or (prev[-1] + token[0]) in ('++', '--', '//', '/*') \
+                    or (prev_kind == 'word' and prev.isdigit() and token == '.'):
+                out.append(' ')
+        pending = None
+
+        out.append(token)
+        if kind == 'blockcomment':
+            out.append('\n')
+            prev, prev_kind, before_prev = None, None, None
+        else:
+            prev, prev_kind, before_prev = token, kind, prev
+
+    return ''.join(out)
+
+
+def minify_css(text):
+    """\
+    Minify CSS source.
+
+    Comments (other than those starting with "/*!") are removed, whitespace is collapsed, and whitespace surrounding
+    braces, semicolons, commas and child combinators is dropped, as are semicolons before a closing brace.
+
+    Arguments:
+    text - CSS source to minify.
+    """
+    out = []
+    pending = False
+    for match in _CSS_TOKEN.finditer(text):
+        kind, token = match.lastgroup, match.group()
+        if kind == 'ws' or (kind == 'comment' and not token.startswith('/*!')):
+            pending = True
+            continue
+        if pending and out and out[-1] not in '{};,>:' and not out[-1].startswith('/*') \
+                and not (kind == 'punct' and token != ':'):
+            out.append(' ')
+        pending = False
+        if token == '}' and out and out[-1] == ';':
+            out.pop()
+        out.append(token)
+
+    return ''.join(out)
+
+
+MINIFIERS = {
+    'css': minify_css,
+    'js': minify_js,
+}
+
+
+def _minify(job):
+    filetype, contents = job
+    return MINIFIERS[filetype](contents)
+
+
+class Minify(Plugin):
+    """\
+    Minify CSS and javascript files.
+
+    The type of each file is taken from the extension of its destination, so the output of Concat and Sass is picked up
+    regardless of the source filenames.  Files whose destination ends in ".min.css" or ".min.js" are assumed to be
+    minified already and are left alone, as are files specifying "skip_minify".
+
+    Minified results are kept in the build cache, keyed by their input, so unchanged bundles are not minified again on
+    rebuild.
+    """
+    requirable = False
+    cache_version = 1
+
+    def __init__(self, mask=None, processes=1, *args, **kwargs):
+        """\
+        Create a new Minify instance.
+
+        Arguments:
+        mask - Files to process, as accepted by fnmatch.  Defaults to all files.
+        processes - Number of worker processes used to minify bundles in parallel.  1 minifies in this process.
+        """
+        super(Minify, self).__init__(*args, **kwargs)
+        self.mask = mask
+        self.processes = processes
+
+    @classmethod
+    def requires(self):
+        return [Contents]
+
+    @staticmethod
+    def filetype(destination):
+        if re.search(r'\.min\.\w+$', destination):
+            return None
+        filetype = os.path.splitext(destination)[1].lstrip('.').lower()
+        return filetype if filetype in MINIFIERS else None
+
+    def _run(self):
+        jobs = []
+        for filename, file_data in self.files.items():
+            if self.mask and not fnmatch.fnmatch(filename, self.mask):
+                continue
+            if file_data.get('skip_minify') or not file_data.get('_contents'):
+                continue
+            filetype = self.filetype(file_data.get('destination', filename))
+            if filetype is None or not isinstance(file_data['_contents'], six.text_type):
+                continue
+
+            self.mark_matched(filename)
+            key = self.cache.key(self.cache_version, filetype, file_data['_contents'])
+            cached = self.cache.get('minify', key)
+            if cached is not None:
+                file_data['_contents'] = cached.decode('utf-8')
+            else:
+                jobs.append((key, filetype, file_data))
+
+        if self.processes > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(self.processes, len(jobs)))
+            try:
+                results = pool.map(_minify, [(filetype, file_data['_contents']) for _, filetype, file_data in jobs])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_minify((filetype, file_data['_contents'])) for _, filetype, file_data in jobs]
+
+        for (key, _, file_data), contents in zip(jobs, results):
+            self.cache.set('minify', key, contents.encode('utf-8'))
+            file_data['_contents'] = contents
+
+
+def _gzip(data, level):
+    buf = BytesIO()
+    # A fixed mtime keeps the output identical between builds
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as fp:
+        fp.write(data)
+    return buf.getvalue()
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+ENCODERS = {
+    'gz': _gzip,
+    'zst': _zstd,
+}
+
+
+def _compress(job):
+    ext, level, data = job
+    return ENCODERS[ext](data, level)
+
+
+class Compress(Plugin):
+    """\
+    Write precompressed copies of files alongside the originals.
+
+    For each file with a compressible mimetype and at least min_size bytes, a new file is added to the file list with
+    ".gz" (and ".zst", if the zstandard module is installed) appended to its destination, suitable for serving with
+    nginx's gzip_static or similar.  This plugin should be run last, after anything that modifies file contents.
+
+    Compressed contents are kept in the build cache, keyed by their input, so sidecars of unchanged files are reused on
+    rebuild.  Sidecars are only written for selected files (see Plugin.selected()), and in a sharded build, by the shard
+    their original belongs to.
+    """
+    requirable = False
+    cache_version = 1
+
+    def __init__(self, mask=None, min_size=256, formats=('gz', 'zst'), mimetypes=None, levels=None, processes=1, *args,
+                 **kwargs):
+        """\
+        Create a new Compress instance.
+
+        Arguments:
+        mask - Files to process, as accepted by fnmatch.  Defaults to all files.
+        min_size - Files smaller than this many bytes are not compressed.
+        formats - Extensions of the compressed files to write, any of "gz" and "zst".  "zst" is skipped when zstandard
+            is not installed.
+        mimetypes - Mimetypes to compress, as accepted by fnmatch.  Defaults to COMPRESSIBLE_MIMETYPES.
+        levels - Dictionary of compression levels by extension.  Defaults to 9 for gzip and 19 for zstandard.
+        processes - Number of worker processes used to compress files in parallel.  1 compresses in this process.
+        """
+        super(Compress, self).__init__(*args, **kwargs)
+        self.mask = mask
+        self.min_size = min_size
+        self.formats = [f for f in formats if f in ENCODERS]
+        self.mimetypes = mimetypes or COMPRESSIBLE_MIMETYPES
+        self.levels = {'gz': 9, 'zst': 19}
+        self.levels.update(levels or {})
+        self.processes = processes
+
+    @classmethod
+    def requires(self):
+        return [Contents]
+
+    def compressible(self, filename, file_data):
+        mimetype = file_data.get('_mimetype') or mimetypes.guess_type(file_data.get('destination', filename))[0]
+        if not mimetype:
+            return False
+        for pattern in self.mimetypes:
+            if fnmatch.fnmatch(mimetype, pattern):
+                return True
+        return False
+
+    def _run(self):
+        formats = [f for f in self.formats if f != 'zst' or zstandard is not None]
+        jobs = []
+        for filename, file_data in list(self.files.items()):
+            if self.mask and not fnmatch.fnmatch(filename, self.mask):
+                continue
+            if file_data.get('skip_write') or file_data.get('_contents') is None or not self.selected(filename):
+                continue
+            if not self.compressible(filename, file_data):
+                continue
+
+            data = file_data['_contents']
+            if isinstance(data, six.text_type):
+                data = data.encode('utf-8')
+            if len(data) < self.min_size:
+                continue
+
+            self.mark_matched(filename)
+            for ext in formats:
+                key = self.cache.key(self.cache_version, ext, self.levels[ext], data)
+                jobs.append(((key, ext, self.levels[ext]), filename + '.' + ext, {
+                    'source': file_data.get('source', filename),
+                    'destination': file_data.get('destination', filename) + '.' + ext,
+                    'shard_key': file_data.get('shard_key', filename),
+                    '_contents': self.cache.get('compress', key),
+                    '_mimetype': 'application/gzip' if ext == 'gz' else 'application/zstd',
+                }, data))
+
+        misses = [job for job in jobs if job[2]['_contents'] is None]
+        if self.processes > 1 and len(misses) > 1:
+            pool = multiprocessing.Pool(min(self.processes, len(misses)))
+            try:
+                results = pool.map(_compress, [(ext, level, data) for (_, ext, level), _, _, data in misses])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_compress((ext, level, data)) for (_, ext, level), _, _, data in misses]
+
+        for ((key, _, _), _, new_data, _), contents in zip(misses, results):
+            self.cache.set('compress', key, contents)
+            new_data['_contents'] = contents
+
+        for _, new_filename, new_data, _ in jobs:
+            self.files[new_filename] = new_data
@@ -1,5 +1,9 @@
+import os
 import logging
 
+from .. import FileStat
+from ..cache import memory_cache
+
 
 logger = logging.getLogger(__name__)
 
@@ -122,6 +126,18 @@ class Plugin(object):
         self.additional_context = context or {}
         self.file_data = file_data or {}
 
+    def prepare(self, breeze_instance):
+        """\
+        Prepare to run this plugin with a particular Breeze instance.
+
+        Called for every plugin, in order, once the file list has been built but before any plugin is run.  This allows
+        a plugin to mark files for the benefit of plugins that run before it.  By default, nothing is done.
+
+        Arguments:
+        breeze_instance - Breeze class instance.
+        """
+        pass
+
     def run(self, breeze_instance):
         """\
         Run this plugin with a particular Breeze instance.
@@ -152,6 +168,63 @@ class Plugin(object):
         """
         raise NotImplementedError("Plugins must implement _run()")
 
+    def cache_path(self, *parts):
+        """\
+        Get a path within the Breeze instance's cache directory.
+
+        The cache directory persists between builds, and is given by the "cache_directory" configuration option.
+
+        Returns the absolute path, or None if there is no cache directory.
+
+        Arguments:
+        *parts - Path components to join to the cache directory.
+        """
+        config = getattr(self.breeze_instance, 'config', None) or {}
+        if not config.get('cache_directory'):
+            return None
+        return os.path.abspath(os.path.join(config['cache_directory'], *parts))
+
+    @property
+    def cache(self):
+        """\
+        The Breeze instance's build cache, for plugins to memoize their work in.
+
+        If the Breeze instance has no cache (there is no cache directory), an in-memory cache lasting for the lifetime of
+        the process is used instead.  See breeze.cache.Cache.
+        """
+        cache = getattr(getattr(self, 'breeze_instance', None), 'cache', None)
+        return cache if cache is not None else memory_cache()
+
+    def stat(self, filename):
+        """\
+        Get the size, modification time and inode of a file in the file list.
+
+        These are recorded when the file list is built, so no system call is made and the result is consistent for the
+        whole build.  Files not read from disk then, like those added by plugins, are stat()ed now.
+
+        Returns a FileStat instance.
+
+        Arguments:
+        filename - Key of the file list.
+        """
+        file_stat = (self.files.get(filename) or {}).get('_stat')
+        if file_stat is None:
+            file_stat = FileStat.from_stat(os.stat(filename))
+        return file_stat
+
+    def selected(self, filename):
+        """\
+        Check whether a file is part of the output being built, see Breeze.selected().
+
+        Plugins doing per-file work that no other file depends on (such as rendering a page) may skip files that are not
+        selected, as they are not written.  Every file is selected in a full build.
+
+        Arguments:
+        filename - Key of the file list.
+        """
+        selected = getattr(self.breeze_instance, 'selected', None)
+        return selected is None or selected(filename)
+
     def delete(self, filename):
         """\
         Delete a file from the file list.
@@ -1,12 +1,32 @@
 import os
+import re
 import fnmatch
 from datetime import datetime
-
-import arrow
+from collections import OrderedDict
 
 from .base import Plugin
 
 
+DESTINATIONS = {
+    'index': ('blog/index.html', 'blog/page/{page}.html'),
+    'archive': ('blog/{year}/{month:02d}/index.html', 'blog/{year}/{month:02d}/page/{page}.html'),
+    'tag': ('blog/tags/{tag}/index.html', 'blog/tags/{tag}/page/{page}.html'),
+    'category': ('blog/categories/{category}/index.html', 'blog/categories/{category}/page/{page}.html'),
+}
+
+
+def slugify(value):
+    return re.sub(r'[^\w]+', '-', value.lower()).strip('-')
+
+
+def _terms(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
 class Blog(Plugin):
     """\
     Make a blog.
@@ -16,38 +36,143 @@ class Blog(Plugin):
 
     The blog posts are marked to avoid having them written out directly, and they are ordered in reverse chronological
     order by their published date.
+
+    Indexes of the posts are built in the same pass, and added to the context along with the ordered list of posts
+    ("blog_posts"):
+    blog_archive - Posts by year, then by month, most recent first.
+    blog_tags - Posts by tag, taken from each post's "tags" (a list, or a comma separated string).
+    blog_categories - Posts by category, taken from each post's "categories" or "category".
+    blog_pages - The pages of the blog index, each a dictionary of its "number", the page "count", its "destination",
+        its "posts", and the "previous" and "next" page's destination (or None).
+
+    Pages listing the posts may be generated too, for each kind of listing given a template: the blog index ("index"),
+    the posts of each month ("archive"), tag ("tag") and category ("category").  Each page is added to the file list
+    under its destination, as an HTML file whose source is the template, and is rendered by the Jinja2 plugin with
+    "posts" and "pagination" (as in "blog_pages") in its file_data, as well as "year" and "month", "tag" or "category"
+    (slugified) and "name" as appropriate.
     """
     requirable = False
     run_once = True
 
-    def __init__(self, mask='posts/*', permalink=None, *args, **kwargs):
+    def __init__(self, mask='posts/*', permalink=None, per_page=None, templates=None, destinations=None, *args,
+                 **kwargs):
         """\
         Create a new Blog instance.
 
         Arguments:
         mask - Files to process, as accepted by fnmatch.
         permalink - If given, a callable that takes each matched file's file_data and returns a new destination.
+        per_page - Number of posts on each page of a listing.  Defaults to all posts on one page.
+        templates - Dictionary of the Jinja2 templates used to generate listing pages, by the kind of listing.  No pages
+            are generated for kinds of listing not given.
+        destinations - Dictionary of the destinations of listing pages, by the kind of listing, overriding DESTINATIONS.
+            Each is a tuple of format strings for the first page, and for the other pages (with "page" available).
         """
         super(Blog, self).__init__(*args, **kwargs)
         self.mask = mask
         self.permalink = permalink or (lambda post: post['destination'])
+        self.per_page = per_page
+        self.templates = templates or {}
+        self.destinations = dict(DESTINATIONS)
+        self.destinations.update(destinations or {})
+
+    def paginate(self, kind, posts, **params):
+        """\
+        Split a listing of posts into pages.
+
+        Returns a list of pages, as described for "blog_pages".
+
+        Arguments:
+        kind - The kind of listing, used to find the destination of each page.
+        posts - List of posts to split.
+        **params - Parameters to the destination format strings.
+        """
+        per_page = self.per_page or len(posts) or 1
+        count = max(1, (len(posts) + per_page - 1) // per_page)
+        first, other = self.destinations[kind]
+        destinations = [first.format(page=1, **params)]
+        destinations += [other.format(page=number, **params) for number in range(2, count + 1)]
+        return [
+            {
+                'number': number,
+                'count': count,
+                'destination': destination,
+                'posts': posts[(number - 1) * per_page:number * per_page],
+                'previous': destinations[number - 2] if number > 1 else None,
+                'next': destinations[number] if number < count else None,
+            }
+            for number, destination in enumerate(destinations, 1)
+        ]
 
     def _run(self):
+        import arrow
+
         self.context['blog_posts'] = []
         for filename, file_data in self.files.items():
             if fnmatch.fnmatch(filename, self.mask):
                 self.mark_matched(filename)
                 default_data = {
                     'title': ' '.join([v[0].upper() + v[1:] for v in os.path.basename(filename).split('.')[0].split('-')]),
-                    # TODO: this sucks, do it better
-                    'published': datetime.fromtimestamp(os.path.getmtime(filename)),
                     'author': 'Anonymous',
                     'slug': os.path.basename(filename).split('.')[0],
                     'skip_write': True,
                 }
                 default_data.update(file_data)
+                if 'published' not in default_data:
+                    # TODO: this sucks, do it better
+                    default_data['published'] = datetime.fromtimestamp(self.stat(filename).mtime)
                 default_data['published'] = arrow.get(default_data['published'])
                 file_data.update(default_data)
                 file_data['destination'] = self.permalink(file_data)
                 self.context['blog_posts'].append((filename, file_data))
-        self.context['blog_posts'] = sorted(self.context['blog_posts'], key=lambda v: v[1]['published'], reverse=True)
+        posts = sorted(self.context['blog_posts'], key=lambda v: v[1]['published'], reverse=True)
+        self.context['blog_posts'] = posts
+
+        archive = OrderedDict()
+        tags = {}
+        categories = {}
+        for post in posts:
+            published = post[1]['published']
+            archive.setdefault(published.year, OrderedDict()).setdefault(published.month, []).append(post)
+            for tag in _terms(post[1].get('tags')):
+                tags.setdefault(tag, []).append(post)
+            for category in _terms(post[1].get('categories', post[1].get('category'))):
+                categories.setdefault(category, []).append(post)
+        self.context['blog_archive'] = archive
+        self.context['blog_tags'] = OrderedDict(sorted(tags.items()))
+        self.context['blog_categories'] = OrderedDict(sorted(categories.items()))
+        self.context['blog_pages'] = self.paginate('index', posts)
+
+        listings = {
+            'index': [({}, posts)],
+            'archive': [
+                ({'year': year, 'month': month}, month_posts)
+                for year, months in archive.items()
+                for month, month_posts in months.items()
+            ],
+            'tag': [
+                ({'tag': slugify(name), 'name': name}, tag_posts)
+                for name, tag_posts in self.context['blog_tags'].items()
+            ],
+            'category': [
+                ({'category': slugify(name), 'name': name}, category_posts)
+                for name, category_posts in self.context['blog_categories'].items()
+            ],
+        }
+        for kind, template in sorted(self.templates.items()):
+            for params, listing_posts in listings[kind]:
+                pages = self.context['blog_pages'] if kind == 'index' else self.paginate(kind, listing_posts, **params)
+                for page in pages:
+                    file_data = dict(params)
+                    file_data.update({
+                        'source': template,
+                        'destination': page['destination'],
+                        'jinja_template': template,
+                        'skip_contents': True,
+                        'blog_listing': kind,
+                        'posts': page['posts'],
+                        'pagination': page,
+                        '_contents': '',
+                        '_mimetype': 'text/html',
+                    })
+                    self.files[page['destination']] = file_data
@@ -7,15 +7,19 @@ from collections import OrderedDict
 import mimetypes
 
 import six
-import magic
-import cchardet as chardet
 
+from .. import map_threads
 from .base import Plugin
 
 
 mimetypes.init()
 
 
+def _read(filename):
+    with open(filename, 'rb') as fp:
+        return fp.read()
+
+
 class Match(Plugin):
     """\
     Match a set of files for the purpose of merging file_data.
@@ -41,12 +45,41 @@ class Match(Plugin):
 class Contents(Plugin):
     """\
     Load the contents of each file in the list.
+
+    Files may specify "skip_contents" to prevent them from being loaded.
+
+    Mimetypes detected by libmagic are cached by the content they were detected from.
+
+    Files are read by a pool of threads, so reads from slow storage overlap; the number of threads is given by the
+    "io_threads" configuration option unless specified.  If any file cannot be read, the error for the first such file
+    in the file list is raised.
     """
     run_once = True
+    cache_version = 1
+
+    def __init__(self, threads=None, *args, **kwargs):
+        """\
+        Create a new Contents instance.
+
+        Arguments:
+        threads - Number of files to read at a time.  Defaults to the "io_threads" configuration option, or 1.
+        """
+        super(Contents, self).__init__(*args, **kwargs)
+        self.threads = threads
 
     @staticmethod
-    def detect_mimetype(name, data):
-        mimetype = magic.from_buffer(data[:1024], mime=True)
+    def detect_mimetype(name, data, cache=None):
+        import magic
+
+        head = data[:1024]
+        mimetype = key = None
+        if cache is not None:
+            key = cache.key(Contents.cache_version, getattr(magic, '__version__', None), head)
+            mimetype = cache.load('mimetype', key)
+        if mimetype is None:
+            mimetype = magic.from_buffer(head, mime=True)
+            if cache is not None:
+                cache.store('mimetype', key, mimetype)
         if mimetype is None or mimetype in ('application/octet-stream', 'binary/octet-stream'):
             mimetype = mimetypes.guess_type(name, strict=False)[0] or mimetype
 
@@ -55,6 +88,8 @@ class Contents(Plugin):
     @staticmethod
     def decode(mimetype, data):
         if mimetype and mimetype.startswith('text/'):
+            import cchardet as chardet
+
             encoding = chardet.detect(data)['encoding']
             candidate_encodings = ['utf-8', 'latin1', 'ascii']
             if encoding in candidate_encodings:
@@ -68,12 +103,17 @@ class Contents(Plugin):
         return data
 
     def _run(self):
-        for filename, file_data in self.files.items():
+        filenames = [filename for filename, file_data in self.files.items() if not file_data.get('skip_contents')]
+        threads = self.threads
+        if threads is None:
+            threads = (getattr(self.breeze_instance, 'config', None) or {}).get('io_threads', 1)
+
+        for filename, contents in zip(filenames, map_threads(_read, filenames, threads)):
+            file_data = self.files[filename]
             self.mark_matched(filename)
-            with open(filename, 'rb') as fp:
-                file_data['_contents'] = fp.read()
-                file_data['_mimetype'] = self.detect_mimetype(filename, file_data['_contents'])
-                file_data['_contents'] = self.decode(file_data['_mimetype'], file_data['_contents'])
+            file_data['_contents'] = contents
+            file_data['_mimetype'] = self.detect_mimetype(filename, file_data['_contents'], self.cache)
+            file_data['_contents'] = self.decode(file_data['_mimetype'], file_data['_contents'])
 
 
 class Weighted(Plugin):
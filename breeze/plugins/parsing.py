@@ -1,14 +1,243 @@
 from __future__ import unicode_literals
 
+import io
 import json
 import os
 
-import yaml
-
+from ..cache import memory_cache
 from .base import Plugin
 from .files import Contents
 
 
+PARSE_CACHE_VERSION = 1
+
+_missing = object()
+
+
+def parse_data(kind, text, cache=None):
+    """\
+    Parse JSON or YAML text.
+
+    YAML is loaded with libyaml's safe loader when it is available.  Results are cached by the text, so the same data
+    file or front matter is only parsed again when it changes; each call returns a fresh copy of the result.
+
+    Arguments:
+    kind - Either "json" or "yaml".
+    text - The text to parse.
+    cache - Cache to keep results in.  Defaults to an in-memory cache for the lifetime of the process.
+    """
+    if kind not in ('json', 'yaml'):
+        raise ValueError("Invalid kind: " + kind)
+    if cache is None:
+        cache = memory_cache()
+    key = cache.key(PARSE_CACHE_VERSION, kind, text)
+    value = cache.load('parse', key, _missing)
+    if value is not _missing:
+        return value
+
+    if kind == 'json':
+        value = json.loads(text)
+    else:
+        import yaml
+
+        value = yaml.load(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+    cache.store('parse', key, value)
+    return value
+
+
+def parse_frontmatter(header, cache=None):
+    """\
+    Parse a JSON or YAML front matter header, as found by Frontmatter or read_frontmatter().
+
+    Arguments:
+    header - The header text, from the opening delimiter up to the closing delimiter.
+    cache - Cache to keep results in, as for parse_data().
+    """
+    if header.startswith('{{{'):
+        return parse_data('json', '{' + header.strip().lstrip('{').rstrip('}') + '}', cache)
+    return parse_data('yaml', header, cache)
+
+
+def read_frontmatter(filename):
+    """\
+    Read the front matter header of a file, without reading the rest of the file.
+
+    Returns the header in the same form that Frontmatter passes to parse_frontmatter(), or None if the file has no
+    (complete) front matter.
+
+    Arguments:
+    filename - The file to read.
+    """
+    with open(filename, 'rb') as fp:
+        # Limited to the length of a delimiter line, so files without front matter (such as images) aren't read further
+        first = fp.readline(5)
+        if first == b'{{{\n':
+            delimiter = b'}}}'
+        elif first == b'---\n':
+            delimiter = b'---'
+        else:
+            return None
+
+        lines = [first]
+        for line in fp:
+            if line.startswith(delimiter):
+                break
+            lines.append(line)
+        else:
+            return None
+
+    try:
+        header = b''.join(lines).decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    if delimiter == b'}}}':
+        return header + '}}}'
+    return header[:-1]
+
+
+def iter_json_array(fp, chunk_size=65536):
+    """\
+    Iterate over the elements of a JSON array, reading the file incrementally.
+
+    Only the element being decoded (plus up to chunk_size characters) is held in memory at any time, so very large
+    arrays can be processed without loading the whole document.
+
+    Arguments:
+    fp - A file object opened in text mode, positioned at the start of the array.
+    chunk_size - Number of characters read from the file at a time.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    expect = '['
+
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            buf = buf[pos:] + fp.read(chunk_size)
+            pos = 0
+            eof = len(buf) == 0
+            continue
+
+        char = buf[pos]
+        if expect == '[':
+            if char != '[':
+                raise ValueError("Expected a JSON array")
+            pos += 1
+            expect = 'first'
+        elif expect != 'value' and char == ']':
+            return
+        elif expect == ',':
+            if char != ',':
+                raise ValueError("Expected ',' or ']' in JSON array")
+            pos += 1
+            expect = 'value'
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            if end is not None and not eof:
+                # Unless followed by a delimiter, the value (e.g. a number) may continue in the next chunk
+                following = end
+                while following < len(buf) and buf[following].isspace():
+                    following += 1
+                if following == len(buf) or buf[following] not in ',]':
+                    end = None
+            if end is None:
+                # Read at least as much again as is buffered, so a large value is not re-decoded too many times
+                data = fp.read(max(chunk_size, len(buf) - pos))
+                buf = buf[pos:] + data
+                pos = 0
+                eof = len(data) == 0
+                continue
+            yield value
+            pos = end
+            expect = ','
+
+
+class LazyData(object):
+    """\
+    The contents of a JSON or YAML data file, loaded and parsed only when first accessed.
+
+    Items and attributes are looked up on the parsed value, so in a template this behaves as the value itself.
+    Iterating over a JSON array that has not been loaded yet streams its elements from disk instead.
+    """
+
+    def __init__(self, filename, kind, cache=None):
+        self._filename = filename
+        self._kind = kind
+        self._cache = cache
+        self._loaded = False
+        self._value = None
+
+    def _load(self):
+        if not self._loaded:
+            with io.open(self._filename, 'r', encoding='utf-8') as fp:
+                self._value = parse_data(self._kind, fp.read(), self._cache)
+            self._loaded = True
+        return self._value
+
+    def __repr__(self):
+        if self._loaded:
+            return repr(self._value)
+        return '<LazyData {}>'.format(self._filename)
+
+    def _fingerprint(self):
+        stat = os.stat(self._filename)
+        return [self._filename, stat.st_size, stat.st_mtime]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __contains__(self, item):
+        return item in self._load()
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return self._load() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __iter__(self):
+        if self._loaded or self._kind != 'json':
+            return iter(self._load())
+        return self._iter_stream()
+
+    def _iter_stream(self):
+        with io.open(self._filename, 'r', encoding='utf-8') as fp:
+            char = fp.read(1)
+            while char and char.isspace():
+                char = fp.read(1)
+            if char != '[':
+                for item in self._load():
+                    yield item
+                return
+            fp.seek(0)
+            for item in iter_json_array(fp):
+                yield item
+
+
 class Parsed(Plugin):
     """\
     Parse the contents of each file if it is of a supported filetype:
@@ -28,9 +257,9 @@ class Parsed(Plugin):
             file_data['_contents_parsed'] = None
             if '_contents' in file_data:
                 if filename.endswith('.json'):
-                    file_data['_contents_parsed'] = json.loads(file_data['_contents'])
+                    file_data['_contents_parsed'] = parse_data('json', file_data['_contents'], self.cache)
                 elif filename.endswith('.yml') or filename.endswith('.yaml'):
-                    file_data['_contents_parsed'] = yaml.load(file_data['_contents'])
+                    file_data['_contents_parsed'] = parse_data('yaml', file_data['_contents'], self.cache)
 
                 if file_data['_contents_parsed'] is not None:
                     self.mark_matched(filename)
@@ -39,26 +268,52 @@ class Parsed(Plugin):
 class Data(Plugin):
     """\
     Merge the parsed contents of each file in the specified directory into the Breeze instance context.
+
+    In lazy mode, JSON and YAML files are instead each added to the context as a LazyData instance named after the
+    file (without its extension), so "data/site.json" becomes "site".  These files are not loaded by Contents or
+    parsed by Parsed; they are read and parsed the first time a template uses them, if at all.
     """
     run_once = True
     requirable = False
 
-    def __init__(self, dir_name='data', *args, **kwargs):
+    def __init__(self, dir_name='data', lazy=False, *args, **kwargs):
         """\
         Create a new Data instance.
 
         Arguments:
         dir_name - The directory name which will be treated as data, merged into the context, and removed from the list.
+        lazy - If true, add each file to the context as a LazyData instance rather than merging its contents.
         """
         super(Data, self).__init__(*args, **kwargs)
         self.dir_name = dir_name
+        self.lazy = lazy
 
     @classmethod
     def requires(self):
         return [Parsed]
 
+    @staticmethod
+    def kind(filename):
+        if filename.endswith('.json'):
+            return 'json'
+        elif filename.endswith('.yml') or filename.endswith('.yaml'):
+            return 'yaml'
+        return None
+
+    def prepare(self, breeze_instance):
+        if self.lazy:
+            for filename, file_data in breeze_instance.filelist(os.path.join(self.dir_name, '*')):
+                if self.kind(filename):
+                    file_data['skip_contents'] = True
+                    file_data['skip_parse'] = True
+
     def _run(self):
         for filename, file_data in self.breeze_instance.filelist(os.path.join(self.dir_name, '*')):
+            if self.lazy and self.kind(filename):
+                name = os.path.splitext(os.path.basename(filename))[0]
+                self.context[name] = LazyData(filename, self.kind(filename), self.cache)
+                self.delete(filename)
+                continue
             contents = file_data.get('_contents_parsed')
             if contents is not None:
                 self.context.update(contents)
@@ -74,6 +329,8 @@ class Frontmatter(Plugin):
 
     YAML front matter starts and ends with "---", each on their own line with no additional whitespace, or any content
     before.  The contents are a YAML dictionary.
+
+    Front matter already read by Metadata is removed from the contents, but not merged into file_data again.
     """
     run_once = True
 
@@ -97,7 +354,8 @@ class Frontmatter(Plugin):
                 except ValueError:
                     continue
 
-                file_data.update(json.loads('{' + contents[:end_pos + 4].strip().lstrip('{').rstrip('}') + '}'))
+                if not file_data.get('_frontmatter'):
+                    file_data.update(parse_frontmatter(contents[:end_pos + 4], self.cache))
                 contents = contents[end_pos + 4:]
                 self.mark_matched(filename)
             elif contents.startswith('---\n'):
@@ -106,7 +364,8 @@ class Frontmatter(Plugin):
                 except ValueError:
                     continue
 
-                file_data.update(yaml.load(contents[:end_pos]))
+                if not file_data.get('_frontmatter'):
+                    file_data.update(parse_frontmatter(contents[:end_pos], self.cache))
                 contents = contents[end_pos + 4:]
                 self.mark_matched(filename)
 
@@ -115,3 +374,39 @@ class Frontmatter(Plugin):
                     contents = contents[1:]
 
             file_data['_contents'] = contents
+
+
+class Metadata(Plugin):
+    """\
+    Merge each file's front matter into its file_data, reading only the front matter from disk.
+
+    This allows plugins that only need file_data, like Blog or Weighted, to run before the (possibly much larger)
+    contents of each file are loaded, or without loading them at all.  Files whose contents are already loaded are
+    left to Frontmatter, which also removes the front matter from the contents once they are loaded.
+
+    Files that have had their front matter read are marked with "_frontmatter".
+    """
+    run_once = True
+
+    def __init__(self, mask=None, *args, **kwargs):
+        """\
+        Create a new Metadata instance.
+
+        Arguments:
+        mask - Files to process, as accepted by fnmatch.  Defaults to all files.
+        """
+        super(Metadata, self).__init__(*args, **kwargs)
+        self.mask = mask
+
+    def _run(self):
+        for filename, file_data in self.breeze_instance.filelist(self.mask):
+            if '_contents' in file_data or file_data.get('skip_contents') or file_data.get('_frontmatter'):
+                continue
+
+            header = read_frontmatter(filename)
+            if header is None:
+                continue
+
+            file_data.update(parse_frontmatter(header, self.cache))
+            file_data['_frontmatter'] = True
+            self.mark_matched(filename)
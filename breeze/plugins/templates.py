@@ -1,24 +1,50 @@
 import os
 import re
 import json
+import errno
+import shutil
 import fnmatch
-
-from jinja2 import (
-    BaseLoader,
-    TemplateNotFound,
-    Environment,
-    )
+import hashlib
+import logging
+import tempfile
+import traceback
+import multiprocessing
+from collections import OrderedDict
 
 import six
 
-import sass
-import markdown
-import arrow
-
-from .base import Plugin
+from ..cache import fingerprint
+from .base import Plugin, MergedDict
 from .files import Contents
 
 
+logger = logging.getLogger(__name__)
+
+_render_state = None
+
+
+def _source_digest(source):
+    return hashlib.sha1(source.encode('utf-8') if isinstance(source, six.text_type) else source).hexdigest()
+
+
+def _fork_pool(processes):
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        return multiprocessing.Pool(processes)
+    except ValueError:
+        return None
+    return context.Pool(processes)
+
+
+def _render_job(job):
+    filename, template = job
+    try:
+        return True, _render_state._render_template(template, _render_state.files[filename])
+    except Exception:
+        return False, traceback.format_exc()
+
+
 class Jinja2(Plugin):
     """\
     Render Jinja2 template files.
@@ -30,65 +56,414 @@ class Jinja2(Plugin):
     rendered to its original filename.
 
     Files may specify "skip_render" to prevent them from being rendered as Jinja - useful for templates or partials.
+
+    The Jinja2 environment is kept between builds, and compiled templates are reused for as long as their source is
+    unchanged.  If the Breeze instance has a build cache, the bytecode of compiled templates is also stored there, keyed
+    by their name and a hash of their source.
+
+    For each rendered file, the set of templates it depends on (the template itself and any it extends, includes or
+    imports, transitively) is recorded in the "dependencies" attribute, and saved to the cache directory if there is
+    one, along with the templates each template references, so a later build need not parse unchanged templates again.
+    In incremental mode, the output of each file is kept in the build cache, keyed by those templates, its own
+    file_data and the context; a file is only rendered again when one of them has changed, in this process or since an
+    earlier build using the same cache.  Templates that reach other files' data through "files" or "filelist" should
+    not be rendered incrementally, as that is not tracked.
+
+    Files may be rendered in parallel by several worker processes.  The workers are forked once the templates have been
+    loaded, and each renders its share of the files against a snapshot of the context and file list taken at that
+    time, so the output of one file is not visible to templates rendering another in the same pass.  Results are
+    applied in file list order.  Parallel rendering requires fork(), and is not available on Windows.
+
+    Only selected files are rendered, in a sharded or partial build (see Breeze.selected()); the dependencies recorded
+    for the others by an earlier build are kept.
+
+    Templates may be compiled ahead of time with the "compile" command, so that a build need not compile any.
+
+    The "filelist" function available to templates returns a list, which is computed once per set of arguments and
+    reused by every file rendered, for as long as no file is added to or removed from the file list.
     """
     run_once = True
 
+    def __init__(self, bytecode_cache=True, incremental=False, processes=1, chunk_size=16, *args, **kwargs):
+        """\
+        Create a new Jinja2 instance.
+
+        Arguments:
+        bytecode_cache - If true, cache compiled templates in the Breeze instance's build cache.
+        incremental - If true, reuse the previous output of files whose templates and data are unchanged.
+        processes - Number of worker processes used to render files in parallel.  1 renders in this process.
+        chunk_size - Number of files sent to a worker process at a time.
+        """
+        super(Jinja2, self).__init__(*args, **kwargs)
+        self.bytecode_cache = bytecode_cache
+        self.incremental = incremental
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.loader = None
+        self.environment = None
+        self.dependencies = {}
+        self._references = None
+        self._rendered_files = []
+        self._template_dependencies = {}
+
     @classmethod
     def requires(self):
         return [Contents]
 
-    class _Loader(BaseLoader):
-        def __init__(self, filelist):
-            self.filelist = filelist
-
-        def get_source(self, environment, template):
-            if template in self.filelist and '_contents' in self.filelist[template]:
-                contents = self.filelist[template]['_contents']
-                if contents is not None:
-                    return contents, template, lambda: False
-
-            raise TemplateNotFound(template)
-
-    def _run(self):
-        self.loader = self._Loader(self.files)
-        self.environment = Environment(loader=self.loader)
+    def _get_environment(self):
+        if self.environment is None:
+            from jinja2 import Environment
+            from ._jinja2 import FileListLoader, CacheBytecodeCache
+
+            bytecode_cache = None
+            cache = getattr(self.breeze_instance, 'cache', None)
+            if self.bytecode_cache and cache is not None:
+                bytecode_cache = CacheBytecodeCache(cache)
+            self.loader = FileListLoader(self.files)
+            directory = self.cache_path('jinja2-modules')
+            if directory:
+                self.loader.use_compiled(directory)
+            self.environment = Environment(loader=self.loader, bytecode_cache=bytecode_cache)
+        self.loader.filelist = self.files
+        return self.environment
+
+    def _setup(self):
+        import arrow
+
+        self._get_environment()
         self.environment.filters.update({
             'tojson': lambda text: json.dumps(text),
         })
         self.environment.filters.update(self.context.get('_jinja_filters', {}))
         self.environment.globals.update({
-            'filelist': self.breeze_instance.filelist,
+            'filelist': getattr(self.breeze_instance, 'memoized_filelist', self.breeze_instance.filelist),
             'now': arrow.utcnow,
         })
 
+    def templates(self):
+        """\
+        Get the names of all templates in the file list.
+
+        These are the files rendered by this plugin or marked "skip_render" (matching "*.jinja*"), and every template
+        named by a file's "jinja_template".
+        """
+        names = set()
+        for filename, file_data in self.files.items():
+            if fnmatch.fnmatch(filename, '*.jinja*') and file_data.get('_contents') is not None:
+                names.add(filename)
+            if file_data.get('jinja_template'):
+                names.add(file_data['jinja_template'])
+        return sorted(names)
+
+    def compile_templates(self, breeze_instance):
+        """\
+        Compile every template in the file list to a Python module, in the Breeze instance's cache directory.
+
+        On later runs, compiled templates are loaded from there instead of being compiled, for as long as their source
+        is unchanged.  This is run by the "compile" command, with the file list as it would be when this plugin is run.
+
+        Arguments:
+        breeze_instance - Breeze class instance.
+        """
+        self.breeze_instance = breeze_instance
+        self.context = MergedDict(self.additional_context, breeze_instance.context)
+        self.files = breeze_instance.files
+        directory = self.cache_path('jinja2-modules')
+        if not directory:
+            raise ValueError("Compiling templates requires a cache directory")
+
+        self._setup()
+        names = [name for name in self.templates() if self.loader._contents(name) is not None]
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        self.environment.compile_templates(
+            directory,
+            filter_func=lambda name: name in names,
+            zip=None,
+            log_function=logger.debug,
+            ignore_errors=False,
+        )
+        with open(os.path.join(directory, 'index.json'), 'w') as fp:
+            json.dump({name: _source_digest(self.loader._contents(name)) for name in names}, fp, indent=1, sort_keys=True)
+        self.loader.use_compiled(directory)
+        return names
+
+    def _template_references(self, name):
+        source = self.loader._contents(name)
+        if source is None:
+            return None, []
+        digest = _source_digest(source)
+        if digest not in self._references:
+            from jinja2 import meta
+
+            references = list(meta.find_referenced_templates(self.environment.parse(source)))
+            if None in references:
+                # A reference that isn't a constant may be to any template at all
+                references = [r for r in references if r is not None] + ['*']
+            self._references[digest] = references
+        return digest, self._references[digest]
+
+    def template_dependencies(self, name):
+        """\
+        Get the templates a template depends on.
+
+        Returns a dictionary of the template and every template it extends, includes or imports, directly or
+        indirectly, mapped to a hash of their source.  If any dependency cannot be determined, "*" is included.
+
+        Arguments:
+        name - Template name (file list key).
+        """
+        if name in self._template_dependencies:
+            return self._template_dependencies[name]
+        dependencies = {}
+        queue = [name]
+        while queue:
+            current = queue.pop()
+            if current in dependencies:
+                continue
+            if current == '*':
+                dependencies[current] = None
+                continue
+            dependencies[current], references = self._template_references(current)
+            queue.extend(references)
+        self._template_dependencies[name] = dependencies
+        return dependencies
+
+    def dependents(self, templates):
+        """\
+        Get the files that depend on any of the given templates.
+
+        Uses the dependencies recorded by the last run of this plugin, or those saved to the cache directory if this
+        plugin has not run yet.  Files with dependencies that could not be determined are always included.
+
+        Returns a sorted list of file list keys.
+
+        Arguments:
+        templates - Template names (file list keys).
+        """
+        dependencies = self.dependencies or self.load_dependencies()
+        templates = set(templates)
+        return sorted(
+            filename
+            for filename, file_dependencies in dependencies.items()
+            if '*' in file_dependencies or templates.intersection(file_dependencies)
+        )
+
+    def _load_dependency_graph(self):
+        graph = {'files': {}, 'references': {}}
+        path = self.cache_path('jinja2-dependencies.json')
+        if path and os.path.exists(path):
+            with open(path, 'r') as fp:
+                try:
+                    graph.update(json.load(fp))
+                except ValueError:
+                    pass
+        return graph
+
+    def load_dependencies(self):
+        """\
+        Load the dependencies saved to the cache directory.
+
+        Returns a dictionary of file list keys mapped to the list of templates each depends on.
+        """
+        return self._load_dependency_graph()['files']
+
+    def _write_dependency_graph(self, path, graph):
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Several processes (such as the shards of a build) may write the same file, so each writes its own first
+        fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(graph, fp, indent=1, sort_keys=True)
+            getattr(os, 'replace', os.rename)(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def save_dependencies(self):
+        """\
+        Save the dependencies recorded by the last run of this plugin to the cache directory, if there is one.
+
+        The templates referenced by each template source are saved too, so they need not be parsed again.  In a sharded
+        build, each shard saves its own dependencies, which are combined by merge_shards().
+        """
+        shard = getattr(self.breeze_instance, 'shard', None)
+        path = self.cache_path('jinja2-dependencies.json' if shard is None else 'jinja2-dependencies.{}.json'.format(shard[0]))
+        if not path:
+            return
+        digests = set(digest for dependencies in self._template_dependencies.values() for digest in dependencies.values())
+        graph = {
+            'files': self.dependencies,
+            'references': {k: v for k, v in self._references.items() if k in digests},
+        }
+        if shard is not None:
+            graph['rendered'] = self._rendered_files
+        self._write_dependency_graph(path, graph)
+
+    def merge_shards(self, breeze_instance, count):
+        """\
+        Combine the dependencies saved by each shard of a sharded build, as those of the whole site.
+
+        This is run by Breeze.merge_shards(), once every shard has been built.
+
+        Arguments:
+        breeze_instance - Breeze class instance.
+        count - Number of shards.
+        """
+        self.breeze_instance = breeze_instance
+        path = self.cache_path('jinja2-dependencies.json')
+        if not path:
+            return
+        files, rendered, references = {}, {}, {}
+        merged = 0
+        for index in range(1, count + 1):
+            shard_path = self.cache_path('jinja2-dependencies.{}.json'.format(index))
+            try:
+                with open(shard_path, 'r') as fp:
+                    graph = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+            # Each shard also keeps the dependencies of the other shards' files from the last build, which are replaced by
+            # those recorded by the shard that rendered them
+            for filename, file_dependencies in graph['files'].items():
+                files.setdefault(filename, file_dependencies)
+            rendered.update((filename, graph['files'][filename]) for filename in graph.get('rendered', []))
+            references.update(graph['references'])
+            os.unlink(shard_path)
+            merged += 1
+        if merged:
+            files.update(rendered)
+            self.dependencies = files
+            self._references = references
+            self._write_dependency_graph(path, {'files': files, 'references': references})
+
+    def _render_template(self, name, file_data):
+        template = self.environment.get_template(name)
+        # Rather than copying everything into a new dictionary for each file, layer the file's data over the context
+        # shared by all files (in the same order of precedence as Template.render(files=..., **file_data, ...))
+        variables = MergedDict(self._file_layer, file_data, self.context, template.globals)
+        context = template.new_context(variables, shared=True)
+        try:
+            return ''.join(template.root_render_func(context))
+        except Exception:
+            self.environment.handle_exception()
+
+    def _render_key(self, filename, file_data, template):
+        dependencies = self.template_dependencies(template)
+        self.dependencies[filename] = sorted(dependencies.keys())
+        if self.incremental and '*' not in dependencies:
+            return fingerprint(filename, template, dependencies, file_data, self._context_fingerprint)
+        return None
+
+    def _render_parallel(self, jobs):
+        global _render_state
+
+        # Load the templates before starting the workers, so they are only compiled once
+        for template in set(template for _, template in jobs):
+            self.environment.get_template(template)
+
+        _render_state = self
+        try:
+            pool = _fork_pool(min(self.processes, len(jobs)))
+            if pool is None:
+                logger.warning("Parallel rendering requires fork(), rendering in this process")
+                return [_render_job(job) for job in jobs]
+            try:
+                return pool.map(_render_job, jobs, self.chunk_size)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _render_state = None
+
+    def _store_rendered(self, key, contents):
+        if key is not None:
+            self.cache.set('jinja2-rendered', key, contents.encode('utf-8'))
+
+    def _render_files(self, jobs):
+        pending = []
+        for filename, template in jobs:
+            file_data = self.files[filename]
+            key = self._render_key(filename, file_data, template)
+            contents = self.cache.get('jinja2-rendered', key) if key is not None else None
+            if contents is not None:
+                file_data['_contents'] = contents.decode('utf-8')
+            elif self.processes > 1:
+                pending.append((filename, template, key))
+            else:
+                file_data['_contents'] = self._render_template(template, file_data)
+                self._store_rendered(key, file_data['_contents'])
+
+        if len(pending) > 1:
+            results = self._render_parallel([(filename, template) for filename, template, _ in pending])
+            for (filename, template, key), (success, contents) in zip(pending, results):
+                if not success:
+                    raise RuntimeError('Failed to render "{}" with template "{}":\n{}'.format(filename, template, contents))
+                self.files[filename]['_contents'] = contents
+                self._store_rendered(key, contents)
+        elif pending:
+            filename, template, key = pending[0]
+            self.files[filename]['_contents'] = self._render_template(template, self.files[filename])
+            self._store_rendered(key, self.files[filename]['_contents'])
+
+    def _run(self):
+        self._setup()
+
+        previous = self.dependencies
+        if self._references is None:
+            graph = self._load_dependency_graph()
+            self._references = graph['references']
+            previous = graph['files']
+        self.dependencies = {}
+        self._template_dependencies = {}
+        self._file_layer = {'files': self.files}
+        self._context_fingerprint = fingerprint(self.context) if self.incremental else None
+
+        jobs = []
         for filename, file_data in self.files.items():
             if fnmatch.fnmatch(filename, '*.jinja*'):
                 if not file_data.get('skip_render'):
                     self.mark_matched(filename)
-                    args = {'filelist': self.breeze_instance.filelist}
-                    args.update(self.context)
-                    args.update(file_data)
-                    args['files'] = self.files
                     file_data['destination'] = re.sub(r'\.jinja', '', file_data['destination'])
-                    file_data['_contents'] = self.environment.get_template(filename).render(**args)
+                    if self.selected(filename):
+                        jobs.append((filename, filename))
+        self._render_files(jobs)
+
+        jobs = []
         for filename, file_data in self.files.items():
             if file_data.get('jinja_template'):
                 self.mark_matched(filename)
-                args = {'filelist': self.breeze_instance.filelist}
-                args.update(self.context)
-                args.update(file_data)
-                args['files'] = self.files
                 file_data['skip_write'] = False
-                file_data['_contents'] = self.environment.get_template(file_data['jinja_template']).render(**args)
+                if self.selected(filename):
+                    jobs.append((filename, file_data['jinja_template']))
+        self._render_files(jobs)
+
+        self._rendered_files = sorted(self.dependencies)
+        # Files not rendered in a sharded or partial build keep the dependencies recorded when they last were
+        for filename, file_dependencies in previous.items():
+            if filename in self.files and not self.selected(filename):
+                self.dependencies.setdefault(filename, file_dependencies)
+        self.save_dependencies()
 
 
 class Markdown(Plugin):
     """\
     Render Markdown files as HTML.
+
+    A single converter is configured per instance of this plugin, and reset between files.  The rendered HTML is kept in
+    the build cache, keyed by the source and the Markdown arguments, so unchanged files are not converted again on
+    rebuild.  Extension instances are identified by their class and configuration (see Extension.getConfigs()).
     """
     requirable = False
     # TODO: Add ability to filter on dir, check for run already, and parse only unparsed
     run_once = True
+    cache_version = 1
 
     def __init__(self, change_extension=True, *args, **kwargs):
         """\
@@ -100,23 +475,93 @@ class Markdown(Plugin):
         super(Markdown, self).__init__(*args, **kwargs)
         self.change_extension = change_extension
         self.markdown_args = kwargs
+        self.converter = None
 
     @classmethod
     def requires(self):
         return [Contents]
 
+    def convert(self, text):
+        """\
+        Convert Markdown source to HTML, using this instance's converter.
+
+        Arguments:
+        text - Markdown source.
+        """
+        if self.converter is None:
+            import markdown
+
+            self.converter = markdown.Markdown(**self.markdown_args)
+        try:
+            return self.converter.convert(text)
+        finally:
+            self.converter.reset()
+
+    def _options_fingerprint(self, version):
+        args = dict(self.markdown_args)
+        if 'extensions' in args:
+            # The repr() of an extension instance differs between instances, so it can't be part of a cache key
+            extensions = []
+            for extension in args['extensions']:
+                if isinstance(extension, six.string_types):
+                    extensions.append(extension)
+                elif callable(getattr(extension, 'getConfigs', None)):
+                    extensions.append((type(extension).__module__, type(extension).__name__, extension.getConfigs()))
+                else:
+                    raise ValueError("Markdown extension {!r} has no configuration to identify it by".format(extension))
+            args['extensions'] = extensions
+        return fingerprint(version, args)
+
     def _run(self):
+        import markdown
+
+        options = self._options_fingerprint(getattr(markdown, '__version__', None))
         for filename, file_data in self.files.items():
             if filename.endswith('.md'):
                 if file_data.get('skip_parse'):
                     continue
                 if '_contents' in file_data:
                     self.mark_matched(filename)
-                    file_data['_contents'] = markdown.markdown(file_data['_contents'], **self.markdown_args)
+                    key = self.cache.key(self.cache_version, options, file_data['_contents'])
+                    html = self.cache.get('markdown', key)
+                    if html is None:
+                        html = self.convert(file_data['_contents']).encode('utf-8')
+                        self.cache.set('markdown', key, html)
+                    file_data['_contents'] = html.decode('utf-8')
                     if self.change_extension:
                         file_data['destination'] = re.sub(r'\.md$', '.html', file_data['destination'])
 
 
+_SASS_IMPORT = re.compile(r'@import\s+([^;]+);')
+_SASS_IMPORT_NAME = re.compile(r'"([^"]+)"|\'([^\']+)\'')
+
+
+def _sass_candidates(name, importer):
+    path = os.path.normpath(os.path.join(os.path.dirname(importer), name))
+    dirname, basename = os.path.split(path)
+    candidates = [path] if os.path.splitext(path)[1] in ('.scss', '.sass') else []
+    for ext in ('.scss', '.sass'):
+        candidates += [os.path.join(dirname, '_' + basename + ext), path + ext]
+    return candidates
+
+
+def _sass_compile(job):
+    import sass
+
+    job = dict(job)
+    filename = job.pop('filename')
+    sources = job.pop('sources')
+
+    def importer(name, previous):
+        # The file being compiled is passed to libsass as a string, so imports made by it come from "stdin"
+        for candidate in _sass_candidates(name, filename if previous == 'stdin' else previous):
+            if sources.get(candidate) is not None:
+                return [(candidate, sources[candidate])]
+        return None
+
+    return sass.compile(importers=[(0, importer)], **job)
+
+
 class Sass(Plugin):
     """\
     Parse Sass files into CSS files.
@@ -125,10 +570,18 @@ class Sass(Plugin):
     into the output directory.
 
     Original SCSS files, as well as includes starting with "_" are removed.
+
+    Imports are resolved against the file list, so partials generated or changed by other plugins are compiled as they
+    are there; partials not in the file list are read from disk.  The files each SCSS file imports, directly or
+    indirectly, are recorded in the "dependencies" attribute.  Compiled CSS is kept in the build cache, keyed by the
+    compile options and every file the SCSS file depends on, so only files affected by a change are compiled again on
+    rebuild.
     """
     requirable = False
+    cache_version = 1
 
-    def __init__(self, directory, output_directory=None, output_style='nested', source_comments=False, *args, **kwargs):
+    def __init__(self, directory, output_directory=None, output_style='nested', source_comments=False, processes=1,
+                 *args, **kwargs):
         """\
         Create a new Sass instance.
 
@@ -137,34 +590,148 @@ class Sass(Plugin):
         output_directory - Destination directory.  Defaults to be the same as the source directory.
         output_style - Sass output style directive.
         source_comments - Sass source_comments directive.
+        processes - Number of worker processes used to compile files in parallel.  1 compiles in this process.
         """
         super(Sass, self).__init__(*args, **kwargs)
         self.directory = directory
         self.output_directory = output_directory
         self.output_style = output_style
         self.source_comments = source_comments
+        self.processes = processes
+        self.dependencies = {}
 
     @classmethod
     def requires(self):
         return [Contents]
 
+    @staticmethod
+    def imports(source):
+        """\
+        Get the names imported by SCSS source, in order.
+
+        Plain CSS imports (of URLs, or of files ending in ".css") are left out, as libsass does not resolve them.
+
+        Arguments:
+        source - SCSS source.
+        """
+        names = []
+        for statement in _SASS_IMPORT.finditer(source):
+            for match in _SASS_IMPORT_NAME.finditer(statement.group(1)):
+                name = match.group(1) or match.group(2)
+                if name.endswith('.css') or re.match(r'^(\w+:)?//', name):
+                    continue
+                names.append(name)
+        return names
+
+    def _source(self, path):
+        if path in self.files:
+            contents = self.files[path].get('_contents')
+            if isinstance(contents, six.binary_type):
+                contents = contents.decode('utf-8')
+            if contents is not None:
+                return contents
+        if os.path.isfile(path):
+            with open(path, 'rb') as fp:
+                return fp.read().decode('utf-8')
+        return None
+
+    def resolve(self, name, importer):
+        """\
+        Find the file an import refers to, as libsass would.
+
+        Returns a tuple of the path (relative, like file list keys) and source of the imported file, or (None, None) if
+        it cannot be found.
+
+        Arguments:
+        name - Imported name.
+        importer - Path of the file containing the import.
+        """
+        for candidate in _sass_candidates(name, importer):
+            source = self._source(candidate)
+            if source is not None:
+                return candidate, source
+        return None, None
+
+    def sources(self, filename):
+        """\
+        Get the sources of an SCSS file and every file it imports, directly or indirectly.
+
+        Returns an ordered dictionary of paths mapped to their source, starting with the file itself.  Imports that
+        cannot be found are included with a source of None.
+
+        Arguments:
+        filename - File list key of the SCSS file.
+        """
+        sources = OrderedDict([(filename, self._source(filename) or '')])
+        queue = [filename]
+        while queue:
+            current = queue.pop(0)
+            for name in self.imports(sources[current] or ''):
+                path, source = self.resolve(name, current)
+                path = path or os.path.normpath(os.path.join(os.path.dirname(current), name))
+                if path not in sources:
+                    sources[path] = source
+                    queue.append(path)
+        return sources
+
+    def _job(self, filename, sources):
+        return {
+            'filename': filename,
+            'sources': sources,
+            'string': sources[filename],
+            'output_style': self.output_style,
+            'source_comments': self.source_comments,
+            'include_paths': [os.path.abspath(os.path.dirname(filename))],
+        }
+
     def _run(self):
+        import sass
+
+        self.dependencies = {}
+        jobs = []
         for filename, file_data in self.breeze_instance.filelist(os.path.join(self.directory, '*')):
             if fnmatch.fnmatch(filename, '*.scss'):
                 if not os.path.basename(filename).startswith('_'):
                     self.mark_matched(filename)
-                    file_data['_contents'] = sass.compile(
-                        string=file_data.get('_contents') or '',
-                        output_style=self.output_style,
-                        source_comments=self.source_comments,
-                        include_paths=[os.path.abspath(os.path.dirname(filename))]
+                    sources = self.sources(filename)
+                    job = self._job(filename, sources)
+                    self.dependencies[filename] = list(sources.keys())[1:]
+                    # The include path is absolute, but depends only on the filename, so it is left out of the key
+                    # for the cache to be shared between checkouts in different places
+                    key = self.cache.key(
+                        self.cache_version,
+                        sass.__version__,
+                        dict(job, string=None, sources=None, include_paths=None),
+                        list(sources.items()),
                     )
+                    css = self.cache.get('sass', key)
+                    if css is not None:
+                        file_data['_contents'] = css.decode('utf-8')
+                    else:
+                        jobs.append((key, file_data, job))
                     file_data['destination'] = os.path.splitext(file_data['destination'])[0] + '.css'
                     if self.output_directory:
                         file_data['destination'] = os.path.join(self.output_directory, os.path.relpath(file_data['destination'], self.directory))
                     continue
             self.delete(filename)
 
+        if self.processes > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(self.processes, len(jobs)))
+            try:
+                results = pool.map(_sass_compile, [job for _, _, job in jobs])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_sass_compile(job) for _, _, job in jobs]
+
+        for (key, file_data, _), contents in zip(jobs, results):
+            self.cache.set('sass', key, contents.encode('utf-8'))
+            file_data['_contents'] = contents
+
+
+_HTML_LINE = re.compile(r'([ \t]*)([^\S\r\n]*)([^\r\n]*)([\r\n]*)')
+
 
 class HTML(Plugin):
     """\
@@ -200,37 +767,49 @@ class HTML(Plugin):
     def requires(self):
         return [Contents]
 
+    def transform(self, text):
+        """\
+        Apply this instance's transformations to a document.
+
+        The document is scanned once, a line at a time.  Runs of two or more line break characters separate blocks,
+        blank lines are dropped and line breaks are normalized to "\\n".
+
+        Arguments:
+        text - Document to transform.
+        """
+        indent_all = self.convert_indentation in (True, '*', 'all')
+        indent_first = indent_all or self.convert_indentation == 'first'
+        line_separator = '<br />\n' if self.nl_to_br else '\n'
+        block_separator = '</p>\n\n<p>' if self.create_paragraphs else '\n\n'
+
+        out = ['<p>'] if self.create_paragraphs else []
+        first = True
+        pos = 0
+        length = len(text)
+        while pos < length:
+            match = _HTML_LINE.match(text, pos)
+            pos = match.end()
+            indent, space, line, breaks = match.groups()
+            if indent or space or line:
+                if not first:
+                    out.append(line_separator)
+                if indent_all or (indent_first and first):
+                    out.append('&nbsp;' * (len(indent) + 3 * indent.count('\t')))
+                    out.append(line)
+                else:
+                    out.extend((indent, space, line))
+                first = False
+            if len(breaks) > 1:
+                out.append(block_separator)
+                first = True
+        if self.create_paragraphs:
+            out.append('</p>')
+
+        return ''.join(out)
+
     def _run(self):
         for filename, file_data in self.breeze_instance.filelist(self.mask):
+            if not self.selected(filename):
+                continue
             self.mark_matched(filename)
-            blocks = [
-                list(filter(None, (b.rstrip('\n') for b in re.split(r'[\r\n]', block))))
-                for block
-                in re.split(r'(?:\r\n|\r|\n){2,}', file_data.get('_contents', ''))
-            ]
-
-            if self.convert_indentation or self.nl_to_br:
-                for block_i, block in enumerate(blocks):
-                    if self.convert_indentation:
-                        for line_i, line in enumerate(block):
-                            if self.convert_indentation in (True, '*', 'all') or (self.convert_indentation == 'first' and line_i == 0):
-                                new_line = []
-                                for c in line:
-                                    if c == '\t':
-                                        new_line.append('&nbsp;' * 4)
-                                    elif c == ' ':
-                                        new_line.append('&nbsp;')
-                                    else:
-                                        break
-                                new_line.append(re.sub(r'^\s+', '', line))
-                                blocks[block_i][line_i] = ''.join(new_line)
-
-                    if self.nl_to_br:
-                        blocks[block_i][:-1] = [l + '<br />' for l in blocks[block_i][:-1]]
-
-            blocks = ['\n'.join(lines) for lines in blocks]
-
-            if self.create_paragraphs:
-                blocks = ['<p>' + block + '</p>' for block in blocks]
-
-            file_data['_contents'] = '\n\n'.join(blocks)
\ No newline at end of file
+            file_data['_contents'] = self.transform(file_data.get('_contents', ''))
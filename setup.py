@@ -17,7 +17,7 @@ config = dict(
     author="Alec Elton",
     author_email="alec.elton@gmail.com",
     url="https://github.com/BasementCat/breeze",
-    packages=["breeze"],
+    packages=["breeze", "breeze.plugins"],
     install_requires=[
         'PyYAML', 'jinja2', 'markdown', 'arrow', 'libsass', 'cchardet', 'python-magic',
     ],
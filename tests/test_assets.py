@@ -0,0 +1,165 @@
+import unittest
+import os
+import gzip
+import shutil
+import tempfile
+from io import BytesIO
+from collections import OrderedDict
+
+import breeze.plugins.assets
+from breeze import Breeze
+from breeze.plugins.assets import Minify, Compress, minify_css, minify_js
+from . import MockAttr, MockBreeze
+
+
+class TestMinifyFunctions(unittest.TestCase):
+    def test_css(self):
+        self.assertEqual(
+            u'a :hover,b>c{color :red;margin:0 auto}/*! keep */@media screen and (max-width:1px){p{content:"a  b"}}',
+            minify_css(u'/* drop */\na :hover , b > c {\n  color : red ;\n  margin: 0 auto;\n}\n/*! keep */\n'
+                       u'@media screen and (max-width: 1px) { p { content: "a  b"; } }\n')
+        )
+
+    def test_js(self):
+        self.assertEqual(
+            u'var a=1+ +b;function f(x){return/a b/.test(x)}\nvar s="a  b";x=a/2/b\n++c',
+            minify_js(u'/* drop */\nvar a = 1 + +b; // drop\nfunction f(x) {\n  return /a b/.test(x)\n}\n'
+                      u'var s = "a  b" ;\nx = a / 2 / b\n++c\n')
+        )
+
+    def test_js__template(self):
+        self.assertEqual(
+            u"log(`x ${b?`y   z`:'w'} v`)",
+            minify_js(u"log(`x ${ b ? `y   z` : 'w' } v`)")
+        )
+        self.assertEqual(
+            u"log(`${{a:1}.a} ${`n ${'q  r'}`}  ok`,`a\\`  ${'b'}`)",
+            minify_js(u"log(`${ {a:  1}.a } ${ `n ${ 'q  r' }` }  ok`, `a\\`  ${'b'}`)")
+        )
+
+    def test_js__regex(self):
+        # After the parentheses of "if", "/" starts a regular expression, otherwise it is a division
+        self.assertEqual(
+            u"if(s)/a  b/.test(s);x=(a+b)/2/c;y=a++/2\nz=[8]/2",
+            minify_js(u"if (s) /a  b/.test(s); x = (a + b) / 2 / c; y = a++ / 2 // c /\nz = [8] / 2")
+        )
+        # After a closing brace, it could be either, so the rest is left as it is
+        self.assertEqual(
+            u"if(b){}\n/a  b/.test('a  b')\n",
+            minify_js(u"if (b) { }\n/a  b/.test('a  b')\n")
+        )
+
+
+class TestMinify(unittest.TestCase):
+    def fixture(self):
+        return OrderedDict([
+            ('js/script.js', {'destination': 'js/script.js', '_contents': u'var a = 1;\n\nvar b = 2;\n'}),
+            ('css/style.scss', {'destination': 'css/style.css', '_contents': u'a {\n  color: red;\n}\n'}),
+            ('js/lib.min.js', {'destination': 'js/lib.min.js', '_contents': u'var a = 1;\n'}),
+            ('js/skip.js', {'destination': 'js/skip.js', 'skip_minify': True, '_contents': u'var a = 1;\n'}),
+            ('index.html', {'destination': 'index.html', '_contents': u'<p>\n  foo\n</p>\n'}),
+        ])
+
+    def test_minify(self):
+        p = Minify()
+        b = MockBreeze(files=self.fixture())
+        p.run(b)
+
+        self.assertEqual(
+            OrderedDict([
+                ('js/script.js', {'destination': 'js/script.js', '_contents': u'var a=1;var b=2;'}),
+                ('css/style.scss', {'destination': 'css/style.css', '_contents': u'a{color:red}'}),
+                ('js/lib.min.js', {'destination': 'js/lib.min.js', '_contents': u'var a = 1;\n'}),
+                ('js/skip.js', {'destination': 'js/skip.js', 'skip_minify': True, '_contents': u'var a = 1;\n'}),
+                ('index.html', {'destination': 'index.html', '_contents': u'<p>\n  foo\n</p>\n'}),
+            ]),
+            b.files
+        )
+
+    def test_mask(self):
+        p = Minify(mask='js/*')
+        b = MockBreeze(files=self.fixture())
+        p.run(b)
+
+        self.assertEqual(u'var a=1;var b=2;', b.files['js/script.js']['_contents'])
+        self.assertEqual(u'a {\n  color: red;\n}\n', b.files['css/style.scss']['_contents'])
+
+    def test_processes(self):
+        p = Minify(processes=2)
+        b = MockBreeze(files=self.fixture())
+        b.files['js/script.js']['_contents'] = u'var c = 3;\n'
+        b.files['css/style.scss']['_contents'] = u'b {\n  color: blue;\n}\n'
+        p.run(b)
+
+        self.assertEqual(u'var c=3;', b.files['js/script.js']['_contents'])
+        self.assertEqual(u'b{color:blue}', b.files['css/style.scss']['_contents'])
+
+
+class TestCompress(unittest.TestCase):
+    def fixture(self):
+        return OrderedDict([
+            ('index.html', {'destination': 'index.html', '_mimetype': 'text/html', '_contents': u'<p>foo</p>\n' * 100}),
+            ('small.html', {'destination': 'small.html', '_mimetype': 'text/html', '_contents': u'<p>foo</p>\n'}),
+            ('js/script.js', {'destination': 'js/script.js', '_contents': u'var a = 1;\n' * 100}),
+            ('image.png', {'destination': 'image.png', '_mimetype': 'image/png', '_contents': b'\x89PNG' * 100}),
+            ('post.md', {'destination': 'post.md', 'skip_write': True, '_mimetype': 'text/plain', '_contents': u'a' * 1000}),
+        ])
+
+    def test_compress(self):
+        p = Compress(formats=('gz',))
+        b = MockBreeze(files=self.fixture())
+        p.run(b)
+
+        self.assertEqual(
+            ['index.html', 'small.html', 'js/script.js', 'image.png', 'post.md', 'index.html.gz', 'js/script.js.gz'],
+            list(b.files.keys())
+        )
+        self.assertEqual('index.html.gz', b.files['index.html.gz']['destination'])
+        self.assertEqual('application/gzip', b.files['index.html.gz']['_mimetype'])
+        self.assertEqual(
+            b.files['index.html']['_contents'].encode('utf-8'),
+            gzip.GzipFile(fileobj=BytesIO(b.files['index.html.gz']['_contents'])).read()
+        )
+        self.assertEqual(
+            b.files['js/script.js']['_contents'].encode('utf-8'),
+            gzip.GzipFile(fileobj=BytesIO(b.files['js/script.js.gz']['_contents'])).read()
+        )
+
+    def test_partial(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ('index.html', 'index.html.gz'):
+            with open(os.path.join(directory, name), 'wb') as fp:
+                fp.write(b'old')
+
+        # The compressed copy of a selected file is selected too, so it is not left out of date
+        b = Breeze()
+        b.config = {'destination': directory}
+        b.only = ['index.html']
+        b.files.update(self.fixture())
+        Compress(formats=('gz',)).run(b)
+        self.assertEqual(['index.html', 'index.html.gz'], sorted(filename for filename in b.files if b.selected(filename)))
+
+        self.assertEqual((2, 0), b.write_output())
+        with gzip.open(os.path.join(directory, 'index.html.gz'), 'rb') as fp:
+            self.assertEqual(b.files['index.html']['_contents'].encode('utf-8'), fp.read())
+
+    def test_processes(self):
+        p = Compress(formats=('gz',), min_size=1, processes=2)
+        b = MockBreeze(files=self.fixture())
+        b.files['small.html']['_contents'] = u'<p>bar</p>'
+        p.run(b)
+
+        self.assertEqual(
+            b'<p>bar</p>',
+            gzip.GzipFile(fileobj=BytesIO(b.files['small.html.gz']['_contents'])).read()
+        )
+
+    def test_no_zstandard(self):
+        p = Compress()
+        b = MockBreeze(files=self.fixture())
+        with MockAttr(breeze.plugins.assets, zstandard=None):
+            p.run(b)
+
+        self.assertNotIn('index.html.zst', b.files)
+        self.assertIn('index.html.gz', b.files)
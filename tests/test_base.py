@@ -1,5 +1,7 @@
 import unittest
+import os
 
+from breeze import FileStat
 from breeze.plugins.base import MergedDict, Plugin
 
 
@@ -182,4 +184,15 @@ class TestPlugin(unittest.TestCase):
                 'baz': {'a': 's'}
             },
             MockBreeze.files
-        )
\ No newline at end of file
+        )
+
+    def test_stat(self):
+        p = Plugin()
+        p.files = {
+            'recorded': {'_stat': FileStat(1, 2, 2000000000, 3)},
+            'tests/test.png': {},
+        }
+
+        self.assertEqual(FileStat(1, 2, 2000000000, 3), p.stat('recorded'))
+        st = os.stat('tests/test.png')
+        self.assertEqual(FileStat(st.st_size, st.st_mtime, st.st_mtime_ns, st.st_ino), p.stat('tests/test.png'))
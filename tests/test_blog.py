@@ -2,12 +2,16 @@ import time
 import unittest
 import datetime
 import os
+import shutil
+import tempfile
 
 import arrow
 
 from . import MockAttr, MockBreeze
 
+from breeze import Breeze, FileStat
 from breeze.plugins.blog import Blog
+from breeze.plugins.templates import Jinja2
 
 
 class TestBlog(unittest.TestCase):
@@ -70,20 +74,132 @@ class TestBlog(unittest.TestCase):
 
         return files, results1, results2
 
+    @staticmethod
+    def mock_stat(filename):
+        return FileStat(0, time.mktime(datetime.datetime(2018, 1, 1, 0, 0, 0, 0).timetuple()), 0, 0)
+
     def test_defaults(self):
         files, res, _ = self.fixture()
         b = MockBreeze(files=files)
 
-        with MockAttr(os.path, getmtime=lambda f: time.mktime(datetime.datetime(2018, 1, 1, 0, 0, 0, 0).timetuple())):
-            p = Blog()
+        p = Blog()
+        with MockAttr(p, stat=self.mock_stat):
             p.run(b)
-            self.assertEqual(res, b.context['blog_posts'])
+        self.assertEqual(res, b.context['blog_posts'])
 
     def test_args(self):
         files, _, res = self.fixture()
         b = MockBreeze(files=files)
 
-        with MockAttr(os.path, getmtime=lambda f: time.mktime(datetime.datetime(2018, 1, 1, 0, 0, 0, 0).timetuple())):
-            p = Blog(mask='blog_posts/*', permalink=lambda post: post['slug'])
+        p = Blog(mask='blog_posts/*', permalink=lambda post: post['slug'])
+        with MockAttr(p, stat=self.mock_stat):
             p.run(b)
-            self.assertEqual(res, b.context['blog_posts'])
+        self.assertEqual(res, b.context['blog_posts'])
+
+    def test_stat(self):
+        files, res, _ = self.fixture()
+        for filename in ('posts/a first post.md', 'posts/b.md'):
+            files[filename]['_stat'] = FileStat(0, time.mktime(datetime.datetime(2018, 1, 1).timetuple()), 0, 0)
+            for result_filename, result in res:
+                if result_filename == filename:
+                    result['_stat'] = files[filename]['_stat']
+        b = MockBreeze(files=files)
+
+        # The files don't exist, so this would fail if they were stat()ed again
+        p = Blog()
+        p.run(b)
+        self.assertEqual(res, b.context['blog_posts'])
+
+    def indexes_fixture(self):
+        return {
+            'posts/a.md': {'destination': 'posts/a.md', 'published': '2018-01-02', 'tags': 'Foo Bar, baz'},
+            'posts/b.md': {'destination': 'posts/b.md', 'published': '2018-01-05', 'tags': ['baz'], 'category': 'News'},
+            'posts/c.md': {'destination': 'posts/c.md', 'published': '2018-03-01', 'categories': ['News', 'Misc']},
+            'posts/d.md': {'destination': 'posts/d.md', 'published': '2017-12-31'},
+        }
+
+    def test_indexes(self):
+        b = MockBreeze(files=self.indexes_fixture())
+        p = Blog(per_page=3)
+        p.run(b)
+        a, b_, c, d = [(f, b.files[f]) for f in ('posts/a.md', 'posts/b.md', 'posts/c.md', 'posts/d.md')]
+
+        self.assertEqual([c, b_, a, d], b.context['blog_posts'])
+        self.assertEqual([(2018, [(3, [c]), (1, [b_, a])]), (2017, [(12, [d])])],
+                         [(y, list(m.items())) for y, m in b.context['blog_archive'].items()])
+        self.assertEqual([('Foo Bar', [a]), ('baz', [b_, a])], list(b.context['blog_tags'].items()))
+        self.assertEqual([('Misc', [c]), ('News', [c, b_])], list(b.context['blog_categories'].items()))
+        self.assertEqual(
+            [
+                {'number': 1, 'count': 2, 'destination': 'blog/index.html', 'posts': [c, b_, a],
+                 'previous': None, 'next': 'blog/page/2.html'},
+                {'number': 2, 'count': 2, 'destination': 'blog/page/2.html', 'posts': [d],
+                 'previous': 'blog/index.html', 'next': None},
+            ],
+            b.context['blog_pages']
+        )
+        self.assertEqual(sorted(self.indexes_fixture().keys()), sorted(b.files.keys()))
+
+    def test_indexes__pages(self):
+        b = MockBreeze(files=self.indexes_fixture())
+        p = Blog(
+            per_page=1,
+            templates={'archive': 'archive.jinja.html', 'tag': 'tag.jinja.html', 'index': 'index.jinja.html'},
+            destinations={'tag': ('tags/{tag}.html', 'tags/{tag}-{page}.html')},
+        )
+        p.run(b)
+
+        self.assertEqual(
+            sorted(list(self.indexes_fixture().keys()) + [
+                'blog/index.html', 'blog/page/2.html', 'blog/page/3.html', 'blog/page/4.html',
+                'blog/2018/03/index.html', 'blog/2018/01/index.html', 'blog/2018/01/page/2.html',
+                'blog/2017/12/index.html',
+                'tags/foo-bar.html', 'tags/baz.html', 'tags/baz-2.html',
+            ]),
+            sorted(b.files.keys())
+        )
+        page = b.files['tags/baz-2.html']
+        self.assertEqual(
+            {
+                'source': 'tag.jinja.html',
+                'destination': 'tags/baz-2.html',
+                'jinja_template': 'tag.jinja.html',
+                'skip_contents': True,
+                'blog_listing': 'tag',
+                'tag': 'baz',
+                'name': 'baz',
+                'posts': [('posts/a.md', b.files['posts/a.md'])],
+                'pagination': page['pagination'],
+                '_contents': '',
+                '_mimetype': 'text/html',
+            },
+            page
+        )
+        self.assertEqual(
+            (2, 2, 'tags/baz.html', None),
+            tuple(page['pagination'][k] for k in ('number', 'count', 'previous', 'next'))
+        )
+        self.assertEqual(2018, b.files['blog/2018/01/page/2.html']['year'])
+        self.assertEqual(1, b.files['blog/2018/01/page/2.html']['month'])
+
+    def test_indexes__write(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        b = Breeze()
+        b.config = {'destination': os.path.join(directory, 'out')}
+        b.files.update(self.indexes_fixture())
+        b.files['index.jinja.html'] = {
+            'destination': 'index.jinja.html',
+            'skip_render': True,
+            'skip_write': True,
+            '_contents': u'{{ pagination.number }}/{{ pagination.count }}:{% for f, post in posts %} {{ f }}{% endfor %} \u2713',
+        }
+        Blog(per_page=3, templates={'index': 'index.jinja.html'}).run(b)
+        Jinja2().run(b)
+
+        self.assertEqual((2, 0), b.write_output())
+        with open(os.path.join(directory, 'out', 'blog', 'index.html'), 'rb') as fp:
+            self.assertEqual(u'1/2: posts/c.md posts/b.md posts/a.md \u2713'.encode('utf-8'), fp.read())
+        with open(os.path.join(directory, 'out', 'blog', 'page', '2.html'), 'rb') as fp:
+            self.assertEqual(u'2/2: posts/d.md \u2713'.encode('utf-8'), fp.read())
@@ -0,0 +1,147 @@
+import unittest
+import io
+import os
+import time
+import shutil
+import tarfile
+import tempfile
+
+from breeze.cache import Cache, fingerprint, memory_cache, MEMORY_CACHE_SIZE
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_key(self):
+        self.assertEqual(Cache.key(1, {'a': 1, 'b': 2}, u'text'), Cache.key(1, {'b': 2, 'a': 1}, u'text'))
+        self.assertNotEqual(Cache.key(1, {'a': 1}, u'text'), Cache.key(2, {'a': 1}, u'text'))
+        self.assertNotEqual(Cache.key(1, {'a': 1}, u'text'), Cache.key(1, {'a': 1}, u'other text'))
+
+    def test_fingerprint(self):
+        from breeze.plugins.base import MergedDict
+        from breeze.plugins.parsing import LazyData
+
+        self.assertEqual(fingerprint({'a': 1, 'b': 2}), fingerprint(MergedDict({'a': 1}, {'b': 2})))
+        self.assertNotEqual(fingerprint({'a': 1}), fingerprint([('a', 1)]))
+        self.assertNotEqual(fingerprint(dict), fingerprint({}))
+
+        # Lazily loaded data is fingerprinted without being loaded
+        path = os.path.join(self.directory, 'data.json')
+        with open(path, 'w') as fp:
+            fp.write('{"a": 1}')
+        data = LazyData(path, 'json')
+        fingerprint(data)
+        self.assertFalse(data._loaded)
+
+    def test_disk(self):
+        c = Cache(self.directory)
+        key = c.key('foo')
+        self.assertIsNone(c.get('test', key))
+        c.set('test', key, b'value')
+        self.assertEqual(b'value', c.get('test', key))
+        self.assertIsNone(c.get('other', key))
+        self.assertEqual(os.path.join(self.directory, 'test', key[:2], key), c.path('test', key))
+
+        # Shared with other instances, and processes, using the same directory
+        c2 = Cache(self.directory)
+        self.assertEqual(b'value', c2.get('test', key))
+
+        c.store('test', key, {'foo': [1, 2]})
+        self.assertEqual({'foo': [1, 2]}, c2.load('test', key))
+        self.assertEqual('default', c2.load('test', c.key('bar'), 'default'))
+
+        self.assertEqual(
+            {
+                'test': {'hits': 1, 'remote_hits': 0, 'misses': 1, 'writes': 2, 'evictions': 0},
+                'other': {'hits': 0, 'remote_hits': 0, 'misses': 1, 'writes': 0, 'evictions': 0},
+            },
+            c.stats
+        )
+        self.assertEqual(
+            'other: 0 hits, 0 remote hits, 1 misses, 0 writes, 0 evictions, '
+            'test: 1 hits, 0 remote hits, 1 misses, 2 writes, 0 evictions',
+            c.summary()
+        )
+        self.assertEqual([], [name for _, _, filenames in os.walk(self.directory) for name in filenames if name.startswith('.')])
+
+    def test_prune(self):
+        c = Cache(self.directory, max_size=10)
+        now = time.time()
+        for i, key in enumerate(('a1', 'b2', 'c3', 'd4')):
+            c.set('test', key, b'1234')
+            os.utime(c.path('test', key), (now - 100 + i, now - 100 + i))
+        # Reading a value makes it the most recently used
+        c.get('test', 'a1')
+        stale = os.path.join(self.directory, 'test', 'a1', '.abc.tmp')
+        fresh = os.path.join(self.directory, 'test', 'a1', '.def.tmp')
+        for path in (stale, fresh):
+            with open(path, 'wb') as fp:
+                fp.write(b'partial')
+        os.utime(stale, (now - 7200, now - 7200))
+
+        self.assertEqual(2, c.prune())
+        self.assertEqual(['a1', 'd4'], sorted(key for _, key, _, _, _ in c.entries()))
+        self.assertEqual(2, c.stats['test']['evictions'])
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+        self.assertEqual(0, Cache(self.directory).prune())
+
+    def test_memory(self):
+        c = Cache(max_size=10)
+        self.assertIsNone(c.path('test', 'a1'))
+        for key in ('a1', 'b2', 'c3'):
+            c.set('test', key, b'1234')
+        self.assertIsNone(c.get('test', 'a1'))
+        self.assertEqual(b'1234', c.get('test', 'b2'))
+        c.set('test', 'd4', b'1234')
+
+        self.assertIsNone(c.get('test', 'c3'))
+        self.assertEqual(b'1234', c.get('test', 'b2'))
+        self.assertEqual(b'1234', c.get('test', 'd4'))
+        self.assertEqual(2, c.stats['test']['evictions'])
+        self.assertEqual([], c.entries())
+        self.assertEqual(0, c.prune())
+
+        self.assertIs(memory_cache(), memory_cache())
+        self.assertIsNone(memory_cache().directory)
+        self.assertEqual(MEMORY_CACHE_SIZE, memory_cache().max_size)
+
+    def test_remote(self):
+        remote = os.path.join(self.directory, 'remote')
+        c = Cache(os.path.join(self.directory, 'local'), remote=remote)
+        c.set('test', 'a1', b'value')
+        self.assertEqual(b'value', Cache(remote).get('test', 'a1'))
+
+        # A cold cache is filled from the remote cache
+        c2 = Cache(os.path.join(self.directory, 'local2'), remote=remote)
+        self.assertEqual(b'value', c2.get('test', 'a1'))
+        self.assertTrue(os.path.exists(c2.path('test', 'a1')))
+        self.assertEqual(b'value', c2.get('test', 'a1'))
+        self.assertIsNone(c2.get('test', 'b2'))
+        self.assertEqual({'test': {'hits': 1, 'remote_hits': 1, 'misses': 1, 'writes': 0, 'evictions': 0}}, c2.stats)
+
+    def test_export_import(self):
+        c = Cache(os.path.join(self.directory, 'a'))
+        c.set('test', 'a1', b'1234')
+        c.set('other', 'b2', b'5678')
+        archive = os.path.join(self.directory, 'cache.tar.gz')
+        self.assertEqual(2, c.export(archive))
+
+        c2 = Cache(os.path.join(self.directory, 'b'))
+        c2.set('test', 'a1', b'kept')
+        self.assertEqual(1, c2.import_archive(archive))
+        self.assertEqual(b'kept', c2.get('test', 'a1'))
+        self.assertEqual(b'5678', c2.get('other', 'b2'))
+
+        # Members that are not cache entries are never extracted
+        with tarfile.open(archive, 'w:gz') as tar:
+            for name in ('../escape', 'test/.hidden', 'test/a1/b2'):
+                info = tarfile.TarInfo(name)
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b'1234'))
+        self.assertEqual(0, Cache(os.path.join(self.directory, 'c')).import_archive(archive))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'escape')))
+        self.assertEqual([], Cache(os.path.join(self.directory, 'c')).entries())
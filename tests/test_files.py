@@ -17,6 +17,7 @@ from breeze.plugins.files import (
     Demote
 )
 import breeze.plugins.files
+from breeze.cache import Cache
 from . import MockBreeze, MockFile
 
 
@@ -64,6 +65,33 @@ class TestContents(unittest.TestCase):
                 b.files
             )
 
+    def test_contents__threads(self):
+        p = Contents(threads=4)
+        b = MockBreeze(files=OrderedDict(('file{}'.format(i), {}) for i in range(20)))
+
+        def _mock_open(fname, mode):
+            if fname in ('file7', 'file12'):
+                raise IOError(fname)
+            return MockFile(fname.encode('ascii'))
+
+        with mock.patch('breeze.plugins.files.open', new=mock.Mock(side_effect=_mock_open)):
+            with self.assertRaises(IOError) as cm:
+                p.run(b)
+            self.assertEqual(('file7',), cm.exception.args)
+
+            del b.files['file7'], b.files['file12']
+            p.run(b)
+        self.assertEqual(['file{}'.format(i) for i in range(20) if i not in (7, 12)], list(b.files))
+        self.assertEqual([u'file{}'.format(i) for i in range(20) if i not in (7, 12)], [f['_contents'] for f in b.files.values()])
+
+    def test_contents__skip(self):
+        p = Contents()
+        b = MockBreeze(files={'foo/a': {'skip_contents': True}})
+
+        with mock.patch('breeze.plugins.files.open', new=mock.Mock(side_effect=IOError)):
+            p.run(b)
+            self.assertEqual({'foo/a': {'skip_contents': True}}, b.files)
+
     def test_contents_image(self):
         p = Contents()
         b = MockBreeze(files={'tests/test.png': {}})
@@ -79,6 +107,13 @@ class TestContents(unittest.TestCase):
             b.files
         )
 
+    def test_detect_mimetype__cache(self):
+        cache = Cache()
+        self.assertEqual('text/plain', Contents.detect_mimetype('a.txt', b'text', cache))
+        with mock.patch('magic.from_buffer', new=mock.Mock(side_effect=AssertionError)):
+            self.assertEqual('text/plain', Contents.detect_mimetype('b.txt', b'text', cache))
+        self.assertEqual({'mimetype': {'hits': 1, 'remote_hits': 0, 'misses': 1, 'writes': 1, 'evictions': 0}}, cache.stats)
+
 
 class TestWeighted(unittest.TestCase):
     def test_weighted(self):
@@ -1,8 +1,17 @@
 import unittest
 import os
+import json
+import time
+import stat
+import shutil
+import tempfile
 from collections import OrderedDict
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
 
-from breeze import InDirectory, Breeze, NotRequirableError
+from breeze import InDirectory, Breeze, NotRequirableError, FileList, FileStat, parse_shard, map_threads
 
 from . import MockAttr
 
@@ -22,6 +31,31 @@ class TestMain_InDirectory(unittest.TestCase):
         self.assertEqual(curdir, os.getcwd())
 
 
+class TestMain_MapThreads(unittest.TestCase):
+    def test_map_threads(self):
+        self.assertEqual([i * 2 for i in range(50)], map_threads(lambda i: i * 2, range(50), 8))
+        self.assertEqual([i * 2 for i in range(50)], map_threads(lambda i: i * 2, range(50), 1))
+        self.assertEqual([], map_threads(lambda i: i * 2, [], 8))
+
+    def test_map_threads__error(self):
+        called = []
+
+        def fail(i):
+            called.append(i)
+            if i % 10 == 3:
+                time.sleep(0.01 if i == 3 else 0)
+                raise ValueError(i)
+            return i
+
+        for threads in (1, 8):
+            del called[:]
+            with self.assertRaises(ValueError) as cm:
+                map_threads(fail, range(50), threads)
+            self.assertEqual((3,), cm.exception.args)
+        # With threads, every call finishes before the error is raised
+        self.assertEqual(list(range(50)), sorted(called))
+
+
 class TestMain_Breeze(unittest.TestCase):
     def test_filelist(self):
         b = Breeze()
@@ -91,6 +125,72 @@ class TestMain_Breeze(unittest.TestCase):
         with self.assertRaises(ValueError):
             list(b.filelist(a__badop="foo"))
 
+    def test_memoized_filelist(self):
+        b = Breeze()
+        b.files['foo'] = {'a': 'foo'}
+        b.files['bar'] = {'a': 'bar'}
+        calls = []
+        filelist = b.filelist
+        def _mock_filelist(*args, **kwargs):
+            calls.append(args)
+            return filelist(*args, **kwargs)
+
+        with MockAttr(b, filelist=_mock_filelist):
+            result = b.memoized_filelist('b*', a__eq='bar')
+            self.assertEqual([('bar', b.files['bar'])], result)
+            self.assertIs(result, b.memoized_filelist('b*', a__eq='bar'))
+            self.assertEqual(1, len(calls))
+
+            self.assertEqual([('foo', b.files['foo'])], b.memoized_filelist('f*'))
+            self.assertEqual(2, len(calls))
+
+            b.files['baz'] = {'a': 'bar'}
+            self.assertEqual(
+                [('bar', b.files['bar']), ('baz', b.files['baz'])],
+                b.memoized_filelist('b*', a__eq='bar')
+            )
+            self.assertEqual(3, len(calls))
+
+            del b.files['bar']
+            self.assertEqual([('baz', b.files['baz'])], b.memoized_filelist('b*', a__eq='bar'))
+            self.assertEqual(4, len(calls))
+
+            # Unhashable arguments are not memoized
+            b.memoized_filelist(a__eq=['bar'])
+            b.memoized_filelist(a__eq=['bar'])
+            self.assertEqual(6, len(calls))
+
+    def test_memoized_filelist__run_plugins(self):
+        b = Breeze()
+        b.files['foo'] = {}
+        results = []
+        class _Plugin(object):
+            def run(self, breeze_instance):
+                results.append(breeze_instance.memoized_filelist())
+        b.plugins = [_Plugin(), _Plugin()]
+        b.run_plugins()
+
+        self.assertEqual(results[0], results[1])
+        self.assertIsNot(results[0], results[1])
+
+    def test_memoized_filelist__new_filelist(self):
+        b = Breeze()
+        b.files['foo'] = {}
+        results = []
+        class _Replace(object):
+            def run(self, breeze_instance):
+                return OrderedDict(breeze_instance.files)
+        class _Add(object):
+            def run(self, breeze_instance):
+                results.append(breeze_instance.memoized_filelist())
+                breeze_instance.files['bar'] = {}
+                results.append(breeze_instance.memoized_filelist())
+        b.plugins = [_Replace(), _Add()]
+        b.run_plugins()
+
+        self.assertIsInstance(b.files, FileList)
+        self.assertEqual([['foo'], ['foo', 'bar']], [[filename for filename, _ in result] for result in results])
+
     def test_build_filelist(self):
         def _mock_listdir(path):
             if path == '/a':
@@ -99,7 +199,8 @@ class TestMain_Breeze(unittest.TestCase):
                     'bar',
                     'bar.ex',
                     'bar.foo',
-                    'inc.foo'
+                    'inc.foo',
+                    'missing',
                 ]
             if path == '/a/b':
                 return [
@@ -109,10 +210,13 @@ class TestMain_Breeze(unittest.TestCase):
                     'inc.foo'
                 ]
 
-        def _mock_isdir(path):
-            return path in ('/a', '/a/b')
+        def _mock_stat(path):
+            if path == '/a/missing':
+                raise OSError(path)
+            mode = stat.S_IFDIR if path in ('/a', '/a/b') else stat.S_IFREG
+            return os.stat_result((mode, len(path), 0, 1, 0, 0, len(path) * 10, 0, 1000, 0))
 
-        with MockAttr(os, listdir=_mock_listdir), MockAttr(os.path, isdir=_mock_isdir):
+        with MockAttr(os, listdir=_mock_listdir), MockAttr(os, stat=_mock_stat):
             b = Breeze()
             b.config = {
                 'source': '/a',
@@ -125,14 +229,38 @@ class TestMain_Breeze(unittest.TestCase):
             b.build_filelist()
             self.assertEqual(
                 OrderedDict([
-                    ('bar', {'source': 'bar', 'destination': 'bar'}),
-                    ('inc.foo', {'source': 'inc.foo', 'destination': 'inc.foo'}),
-                    ('b/bar', {'source': 'b/bar', 'destination': 'b/bar'}),
-                    ('b/inc.foo', {'source': 'b/inc.foo', 'destination': 'b/inc.foo'}),
+                    ('bar', {'source': 'bar', 'destination': 'bar', '_stat': FileStat(60, 1000, 1000000000000, 6)}),
+                    ('inc.foo', {'source': 'inc.foo', 'destination': 'inc.foo', '_stat': FileStat(100, 1000, 1000000000000, 10)}),
+                    ('missing', {'source': 'missing', 'destination': 'missing'}),
+                    ('b/bar', {'source': 'b/bar', 'destination': 'b/bar', '_stat': FileStat(80, 1000, 1000000000000, 8)}),
+                    ('b/inc.foo', {'source': 'b/inc.foo', 'destination': 'b/inc.foo', '_stat': FileStat(120, 1000, 1000000000000, 12)}),
                 ]),
                 b.files
             )
 
+    def test_source_snapshot(self):
+        def _mock_listdir(path):
+            return {'/a': ['b', 'bar', 'bar.ex', '_partial.scss'], '/a/b': ['bar.foo']}[path]
+
+        def _mock_stat(path):
+            mode = stat.S_IFDIR if path in ('/a', '/a/b') else stat.S_IFREG
+            return os.stat_result((mode, len(path), 0, 1, 0, 0, len(path) * 10, 0, 1000, 0))
+
+        with MockAttr(os, listdir=_mock_listdir), MockAttr(os, stat=_mock_stat):
+            b = Breeze()
+            b.config = {'source': '/a', 'include': ['*'], 'exclude': ['*.ex'], 'exclude_files': ['_*', '*.foo'], 'include_files': []}
+
+            # Files excluded by name may still be read by plugins, so they are watched too
+            self.assertEqual(
+                {
+                    'bar': FileStat(60, 1000, 1000000000000, 6),
+                    '_partial.scss': FileStat(160, 1000, 1000000000000, 16),
+                    'b/bar.foo': FileStat(120, 1000, 1000000000000, 12),
+                },
+                b.source_snapshot()
+            )
+            self.assertEqual({}, dict(b.files))
+
     def test__plugin_require(self):
         loaded = []
 
@@ -207,6 +335,21 @@ class TestMain_Breeze(unittest.TestCase):
 
         self.assertEqual([MockRequiredPlugin, MockPlugin], loaded)
 
+    def test_plugin__name(self):
+        b = Breeze()
+        b.plugin('Match', mask='*.md').plugin('Contents').plugin('Promote')
+        self.assertEqual(['Match', 'Contents', 'Promote'], [plugin.__class__.__name__ for plugin in b.plugins])
+        self.assertEqual('*.md', b.plugins[0].mask)
+        with self.assertRaises(ValueError):
+            b.plugin('Missing')
+
+    def test_configure_plugins(self):
+        b = Breeze()
+        b.plugin('Contents')
+        b.configure_plugins(['Data', {'plugin': 'Match', 'mask': 'md_pages/*', 'file_data': {'jinja_template': 'page.jinja.html'}}])
+        self.assertEqual(['Contents', 'Parsed', 'Data', 'Match'], [plugin.__class__.__name__ for plugin in b.plugins])
+        self.assertEqual({'jinja_template': 'page.jinja.html'}, b.plugins[3].file_data)
+
     def test_run(self):
         loaded = []
         run = []
@@ -237,3 +380,332 @@ class TestMain_Breeze(unittest.TestCase):
         b.run_plugins()
         self.assertEqual([MockRequiredPlugin, MockPlugin], loaded)
         self.assertEqual([MockRequiredPlugin, MockPlugin], run)
+
+    def test_run__no_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'config.json'), 'w') as fp:
+            json.dump({'cache_directory': None, 'shard_directory': None, 'destination': '_out', 'plugins': ['Contents']}, fp)
+        with open(os.path.join(directory, 'page.html'), 'w') as fp:
+            fp.write('page')
+
+        b = Breeze()
+        self.assertEqual(0, b.run([os.path.join(directory, 'manage.py'), 'build'], exit=False))
+        self.assertIsNone(b.cache)
+        with open(os.path.join(directory, '_out', 'page.html'), 'r') as fp:
+            self.assertEqual('page', fp.read())
+
+    def test_run__prepare(self):
+        calls = []
+
+        class MockPlugin(object):
+            requirable = True
+            run_once = False
+
+            def prepare(self, breeze):
+                calls.append(('prepare', self))
+
+            def run(self, breeze):
+                calls.append(('run', self))
+
+            @classmethod
+            def requires(cls):
+                return []
+
+        a, b = MockPlugin(), MockPlugin()
+        br = Breeze()
+        br.plugin(a).plugin(b)
+        br.run_plugins()
+
+        self.assertEqual([('prepare', a), ('prepare', b), ('run', a), ('run', b)], calls)
+
+    def test_command_compile(self):
+        calls = []
+
+        class MockPlugin(object):
+            requirable = True
+            run_once = False
+
+            def __init__(self, name):
+                self.name = name
+
+            def run(self, breeze):
+                calls.append(('run', self.name))
+
+            @classmethod
+            def requires(cls):
+                return []
+
+        class MockCompilingPlugin(MockPlugin):
+            def compile_templates(self, breeze):
+                calls.append(('compile', self.name))
+                return []
+
+        b = Breeze()
+        b.root_directory = os.getcwd()
+        b.plugin(MockPlugin('a')).plugin(MockCompilingPlugin('b')).plugin(MockPlugin('c'))
+        with MockAttr(b, build_filelist=lambda: None):
+            b._command_compile()
+
+        self.assertEqual([('run', 'a'), ('compile', 'b')], calls)
+
+    def test_parse_shard(self):
+        self.assertIsNone(parse_shard(None))
+        self.assertEqual((2, 4), parse_shard('2/4'))
+        for value in ('0/4', '5/4', '2', 'a/b'):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_in_shard(self):
+        b = Breeze()
+        for i in range(100):
+            b.files['file{}.html'.format(i)] = {}
+        b.files['file0.html.gz'] = {'shard_key': 'file0.html'}
+        self.assertTrue(all(b.in_shard(filename) for filename in b.files))
+
+        shards = []
+        for index in range(1, 5):
+            b.shard = (index, 4)
+            shards.append(set(filename for filename in b.files if b.in_shard(filename)))
+        self.assertEqual(set(b.files), set.union(*shards))
+        self.assertEqual(len(b.files), sum(len(shard) for shard in shards))
+        self.assertTrue(all(shard for shard in shards))
+        self.assertTrue(any(set(['file0.html', 'file0.html.gz']) <= shard for shard in shards))
+
+    def test_merge_shards(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config = {'destination': os.path.join(directory, 'out'), 'shard_directory': os.path.join(directory, 'shards'), 'io_threads': 4}
+
+        def files():
+            files = OrderedDict()
+            for i in range(10):
+                files['file{}.html'.format(i)] = {'destination': 'dir/file{}.html'.format(i), '_contents': b'contents ' + str(i).encode('ascii')}
+            files['skipped'] = {'destination': 'skipped', 'skip_write': True}
+            return files
+
+        for index in (1, 2, 3):
+            b = Breeze()
+            b.config = config
+            b.shard = (index, 3)
+            b.files.update(files())
+            b._source_fingerprint = b.source_fingerprint()
+            b.write_output()
+
+        b = Breeze()
+        b.config = config
+        with open(os.path.join(config['shard_directory'], '2.json')) as fp:
+            manifest = json.load(fp)
+        self.assertEqual((2, 3), (manifest['shard'], manifest['shards']))
+        self.assertTrue(manifest['outputs'])
+        self.assertEqual(
+            sorted(manifest['outputs']),
+            sorted(os.path.relpath(os.path.join(dirpath, name), b.shard_destination(2)) for dirpath, _, names in os.walk(b.shard_destination(2)) for name in names)
+        )
+
+        merged = []
+        class _Plugin(object):
+            def merge_shards(self, breeze_instance, count):
+                merged.append((breeze_instance, count))
+        b.plugins = [_Plugin()]
+        b.merge_shards()
+        self.assertEqual([(b, 3)], merged)
+        self.assertEqual(['file{}.html'.format(i) for i in range(10)], sorted(os.listdir(os.path.join(config['destination'], 'dir'))))
+        with open(os.path.join(config['destination'], 'dir', 'file3.html'), 'rb') as fp:
+            self.assertEqual(b'contents 3', fp.read())
+
+        name = sorted(manifest['outputs'])[0]
+        with open(os.path.join(b.shard_destination(2), name), 'wb') as fp:
+            fp.write(b'corrupt')
+        with self.assertRaises(ValueError):
+            b.merge_shards()
+        self.assertTrue(os.path.exists(os.path.join(config['destination'], name)))
+
+        os.unlink(os.path.join(config['shard_directory'], '2.json'))
+        with self.assertRaises(ValueError):
+            b.merge_shards()
+
+    def test_write_output__incremental(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        out = os.path.join(directory, 'out')
+        b = Breeze()
+        b.config = {'destination': out, 'io_threads': 4}
+
+        def files(**changes):
+            files = OrderedDict([
+                ('a', {'destination': 'a.html', '_contents': b'a'}),
+                ('b', {'destination': 'dir/b.html', '_contents': b'b'}),
+                ('c', {'destination': 'other/c.html', '_contents': b'c'}),
+                ('d', {'destination': 'd.html', 'skip_write': True}),
+            ])
+            for key, value in changes.items():
+                if value is None:
+                    del files[key]
+                else:
+                    files[key]['_contents'] = value
+            return files
+
+        b.files.update(files())
+        self.assertEqual((3, 0), b.write_output(incremental=True))
+        inode = os.stat(os.path.join(out, 'a.html')).st_ino
+        with open(os.path.join(out, 'stale.html'), 'wb') as fp:
+            fp.write(b'stale')
+
+        b._reset()
+        b.files.update(files(b=b'changed', c=None))
+        self.assertEqual((1, 2), b.write_output(incremental=True))
+        self.assertEqual(inode, os.stat(os.path.join(out, 'a.html')).st_ino)
+        with open(os.path.join(out, 'dir', 'b.html'), 'rb') as fp:
+            self.assertEqual(b'changed', fp.read())
+        self.assertEqual(['a.html', 'dir'], sorted(os.listdir(out)))
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(0o666 & ~umask, os.stat(os.path.join(out, 'dir', 'b.html')).st_mode & 0o777)
+
+        # Files already in the destination are compared with their contents
+        b2 = Breeze()
+        b2.config = {'destination': out}
+        b2.files.update(files(b=b'changed', c=None))
+        self.assertEqual((0, 0), b2.write_output(incremental=True))
+
+    def test_rebuild(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        out = os.path.join(directory, 'out')
+
+        class MockPlugin(object):
+            requirable = True
+            run_once = False
+            fail = False
+
+            def run(self, breeze):
+                if self.fail:
+                    raise ValueError("Failed")
+                breeze.files['a'] = {'destination': 'a.html', '_contents': b'a'}
+
+            @classmethod
+            def requires(cls):
+                return []
+
+        plugin = MockPlugin()
+        b = Breeze()
+        b.root_directory = directory
+        b.config = {'destination': out}
+        b.plugin(plugin)
+        with MockAttr(b, build_filelist=lambda: None):
+            self.assertEqual(['files', 'plugins', 'write', 'total'], list(b.rebuild()))
+            plugin.fail = True
+            with self.assertRaises(ValueError):
+                b.rebuild()
+        self.assertEqual(['a.html'], os.listdir(out))
+
+    def test_command_watch(self):
+        snapshots = [{'a': 1}, {'a': 1}, {'a': 2}, {'a': 3}, {'a': 3}]
+        sleeps = []
+        rebuilds = []
+
+        def sleep(seconds):
+            if not snapshots:
+                raise KeyboardInterrupt()
+            sleeps.append(seconds)
+
+        b = Breeze()
+        b.root_directory = os.getcwd()
+        b.config = {'watch_interval': 1, 'watch_debounce': 0.1}
+        with MockAttr(b, source_snapshot=lambda: snapshots.pop(0)):
+            with MockAttr(b, rebuild=lambda: rebuilds.append(True)):
+                with MockAttr(time, sleep=sleep):
+                    b._command_watch()
+
+        self.assertEqual([1, 1, 0.1, 0.1], sleeps)
+        self.assertEqual(2, len(rebuilds))
+
+    def test_command_watch__templates(self):
+        from breeze.plugins.templates import Jinja2
+
+        snapshots = [{'base.html': 1}, {'base.html': 2}, {'base.html': 2}]
+        rebuilds = []
+        dependents = []
+
+        def sleep(seconds):
+            if not snapshots:
+                raise KeyboardInterrupt()
+
+        def rebuild():
+            rebuilds.append(True)
+            if len(rebuilds) == 1:
+                raise ValueError("Broken template")
+
+        plugin = Jinja2()
+        plugin.dependencies = {'page.html': ['base.html', 'page.html'], 'other.html': ['other.html']}
+        _dependents = plugin.dependents
+
+        def _mock_dependents(templates):
+            dependents.append(_dependents(templates))
+            return dependents[-1]
+
+        b = Breeze()
+        b.root_directory = os.getcwd()
+        b.config = {'watch_interval': 1, 'watch_debounce': 0.1}
+        b.plugins.append(plugin)
+        with MockAttr(b, source_snapshot=lambda: snapshots.pop(0)):
+            with MockAttr(b, rebuild=rebuild):
+                with MockAttr(plugin, dependents=_mock_dependents):
+                    with MockAttr(time, sleep=sleep):
+                        with mock.patch('breeze.logger') as logger:
+                            b._command_watch()
+
+        # A broken first build is logged, and watching goes on
+        self.assertEqual(2, len(rebuilds))
+        self.assertEqual(1, logger.error.call_count)
+        self.assertFalse(plugin.incremental)
+        self.assertEqual([['page.html']], dependents)
+        logger.info.assert_any_call("Using changed templates: %s", 'page.html')
+
+    def test_selected(self):
+        b = Breeze()
+        b.files.update({
+            'index.jinja.html': {'destination': 'index.html'},
+            'posts/a.md': {'destination': 'posts/a.html'},
+            'posts/b.md': {'destination': './posts/b.html'},
+            'css/site.scss': {'destination': 'css/site.css'},
+        })
+        self.assertTrue(all(b.selected(filename) for filename in b.files))
+
+        b.only = ['posts/*', 'index.html']
+        self.assertEqual(
+            ['index.jinja.html', 'posts/a.md', 'posts/b.md'],
+            sorted(filename for filename in b.files if b.selected(filename))
+        )
+
+        b.shard = (1, 2)
+        self.assertEqual(
+            sorted(filename for filename in b.files if b.in_shard(filename) and filename != 'css/site.scss'),
+            sorted(filename for filename in b.files if b.selected(filename))
+        )
+
+    def test_write_output__partial(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        out = os.path.join(directory, 'out')
+        os.makedirs(os.path.join(out, 'posts'))
+        for name in ('index.html', 'posts/a.html', 'posts/old.html'):
+            with open(os.path.join(out, name), 'wb') as fp:
+                fp.write(b'old')
+
+        b = Breeze()
+        b.config = {'destination': out}
+        b.only = ['posts/*']
+        b.files.update({
+            'index.jinja.html': {'destination': 'index.html', '_contents': b'new'},
+            'posts/a.md': {'destination': 'posts/a.html', '_contents': b'new'},
+            'posts/b.md': {'destination': 'posts/b.html', '_contents': b'new'},
+        })
+        self.assertEqual((2, 0), b.write_output())
+
+        contents = {}
+        for name in ('index.html', 'posts/a.html', 'posts/b.html', 'posts/old.html'):
+            with open(os.path.join(out, name), 'rb') as fp:
+                contents[name] = fp.read()
+        self.assertEqual({'index.html': b'old', 'posts/a.html': b'new', 'posts/b.html': b'new', 'posts/old.html': b'old'}, contents)
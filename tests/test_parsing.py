@@ -1,11 +1,57 @@
 import unittest
+import io
+import os
+import shutil
+import tempfile
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+import yaml
 
 from breeze.plugins.parsing import (
+    parse_data,
+    parse_frontmatter,
+    read_frontmatter,
+    iter_json_array,
+    LazyData,
     Parsed,
     Data,
     Frontmatter,
+    Metadata,
 )
-from . import MockBreeze
+from breeze.cache import Cache
+from . import MockAttr, MockBreeze
+
+
+class TestParseData(unittest.TestCase):
+    def test_parse_data(self):
+        self.assertEqual({'foo': ['bar']}, parse_data('json', u'{"foo": ["bar"]}'))
+        self.assertEqual({'foo': ['bar']}, parse_data('yaml', u'foo:\n    - bar\n'))
+        with self.assertRaises(ValueError):
+            parse_data('xml', u'<foo />')
+
+    def test_parse_data__cache(self):
+        calls = []
+
+        def _mock_load(text, Loader):
+            calls.append(Loader)
+            return {'foo': ['bar']}
+
+        cache = Cache()
+        with MockAttr(yaml, load=_mock_load):
+            a = parse_data('yaml', u'foo:\n    - bar\n', cache)
+            b = parse_data('yaml', u'foo:\n    - bar\n', cache)
+
+        self.assertEqual([getattr(yaml, 'CSafeLoader', yaml.SafeLoader)], calls)
+        self.assertEqual(a, b)
+        self.assertIsNot(a['foo'], b['foo'])
+        self.assertEqual({'parse': {'hits': 1, 'remote_hits': 0, 'misses': 1, 'writes': 1, 'evictions': 0}}, cache.stats)
+
+    def test_parse_data__safe(self):
+        with self.assertRaises(yaml.YAMLError):
+            parse_data('yaml', u'!!python/object/apply:os.system ["true"]')
 
 
 class TestParsed(unittest.TestCase):
@@ -97,6 +143,85 @@ class TestData(unittest.TestCase):
             b.context
         )
 
+    def test_lazy(self):
+        p = Data(lazy=True)
+        b = MockBreeze(files={
+            'data/site.json': {},
+            'data/items.yml': {},
+            'data/readme.txt': {},
+            'notdata/3.json': {},
+        })
+        p.prepare(b)
+
+        self.assertEqual(
+            {
+                'data/site.json': {'skip_contents': True, 'skip_parse': True},
+                'data/items.yml': {'skip_contents': True, 'skip_parse': True},
+                'data/readme.txt': {},
+                'notdata/3.json': {},
+            },
+            b.files
+        )
+
+        p.run(b)
+        self.assertEqual(['data/readme.txt', 'notdata/3.json'], sorted(b.files.keys()))
+        self.assertEqual(['items', 'site'], sorted(b.context.keys()))
+        self.assertIsInstance(b.context['site'], LazyData)
+        self.assertEqual('data/site.json', b.context['site']._filename)
+        self.assertEqual('yaml', b.context['items']._kind)
+        self.assertFalse(b.context['site']._loaded)
+
+
+class TestIterJSONArray(unittest.TestCase):
+    def test_iter_json_array(self):
+        doc = u' [ 1, 22222, "a,]", {"x": [1, 2]}, true , null, 3.5e2 ] '
+        for chunk_size in (1, 2, 3, 100):
+            self.assertEqual(
+                [1, 22222, u'a,]', {'x': [1, 2]}, True, None, 350.0],
+                list(iter_json_array(io.StringIO(doc), chunk_size=chunk_size))
+            )
+        self.assertEqual([], list(iter_json_array(io.StringIO(u'[]'))))
+
+    def test_iter_json_array__invalid(self):
+        for doc in (u'{"a": 1}', u'[1,', u'[1 2]', u'[1,]'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(io.StringIO(doc), chunk_size=2))
+
+
+class TestLazyData(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, contents):
+        filename = os.path.join(self.directory, name)
+        with io.open(filename, 'w', encoding='utf-8') as fp:
+            fp.write(contents)
+        return filename
+
+    def test_lazy(self):
+        d = LazyData(self.write('site.yml', u'title: foo\nitems:\n    - bar\n'), 'yaml')
+        self.assertFalse(d._loaded)
+        self.assertEqual(u'foo', d['title'])
+        self.assertTrue(d._loaded)
+        self.assertEqual([u'bar'], d.get('items'))
+        self.assertIn('title', d)
+        self.assertEqual(2, len(d))
+        self.assertEqual({'title': u'foo', 'items': [u'bar']}, d)
+
+    def test_stream(self):
+        d = LazyData(self.write('items.json', u'[{"a": 1}, {"a": 2}]'), 'json')
+        self.assertEqual([{'a': 1}, {'a': 2}], [item for item in d])
+        self.assertFalse(d._loaded)
+        self.assertEqual(2, len(d))
+        self.assertTrue(d._loaded)
+
+    def test_stream__object(self):
+        d = LazyData(self.write('site.json', u'{"a": 1}'), 'json')
+        self.assertEqual(['a'], list(d))
+
 
 class TestFrontmatter(unittest.TestCase):
     def test_frontmatter(self):
@@ -128,3 +253,81 @@ class TestFrontmatter(unittest.TestCase):
             },
             b.files
         )
+
+    def test_frontmatter__metadata(self):
+        p = Frontmatter()
+        b = MockBreeze(files={
+            'a': {'_contents': u'---\nbaz: quux\n---\nb', '_mimetype': 'text/plain', 'baz': 'changed', '_frontmatter': True},
+        })
+        p.run(b)
+
+        self.assertEqual(
+            {'a': {'_contents': u'b', '_mimetype': 'text/plain', 'baz': 'changed', '_frontmatter': True}},
+            b.files
+        )
+
+
+class TestMetadata(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, contents):
+        filename = os.path.join(self.directory, name)
+        with io.open(filename, 'wb') as fp:
+            fp.write(contents)
+        return filename
+
+    def test_read_frontmatter(self):
+        self.assertEqual(
+            u'{{{\n"foo": "bar"\n}}}',
+            read_frontmatter(self.write('a', b'{{{\n"foo": "bar"\n}}}\na'))
+        )
+        self.assertEqual(u'---\nbaz: quux', read_frontmatter(self.write('b', b'---\nbaz: quux\n---\nb')))
+        self.assertEqual(None, read_frontmatter(self.write('c', b'{{\ninvalid\n}}\nc')))
+        self.assertEqual(None, read_frontmatter(self.write('d', b'---\nunterminated: true\n')))
+        self.assertEqual(None, read_frontmatter(self.write('e', b'\x89PNG\r\n')))
+
+    def test_read_frontmatter__binary(self):
+        reads = []
+
+        class File(io.BytesIO):
+            def readline(self, *args):
+                line = io.BytesIO.readline(self, *args)
+                reads.append(len(line))
+                return line
+
+        with mock.patch('breeze.plugins.parsing.open', create=True, new=lambda filename, mode: File(b'\x00' * 65536 + b'\n')):
+            self.assertEqual(None, read_frontmatter('image.png'))
+        self.assertEqual([5], reads)
+
+    def test_parse_frontmatter(self):
+        self.assertEqual({'foo': 'bar'}, parse_frontmatter(u'{{{\n"foo": "bar"\n}}}'))
+        self.assertEqual({'baz': 'quux'}, parse_frontmatter(u'---\nbaz: quux'))
+
+    def test_metadata(self):
+        a = self.write('a', b'{{{\n"foo": "bar"\n}}}\na')
+        b = self.write('b', b'---\nbaz: quux\n---\nb')
+        c = self.write('c', b'no front matter')
+        p = Metadata()
+        br = MockBreeze(files={
+            a: {},
+            b: {},
+            c: {},
+            'd': {'_contents': u'---\nbaz: quux\n---\nd'},
+            'e': {'skip_contents': True},
+        })
+        p.run(br)
+
+        self.assertEqual(
+            {
+                a: {'foo': 'bar', '_frontmatter': True},
+                b: {'baz': 'quux', '_frontmatter': True},
+                c: {},
+                'd': {'_contents': u'---\nbaz: quux\n---\nd'},
+                'e': {'skip_contents': True},
+            },
+            br.files
+        )
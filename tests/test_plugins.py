@@ -0,0 +1,84 @@
+import unittest
+import os
+import sys
+import subprocess
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+import breeze.plugins
+from breeze.plugins import PluginSpec, plugin_registry, load_plugin
+
+
+# Maximum time to import breeze.plugins, in seconds
+IMPORT_BUDGET = float(os.environ.get('BREEZE_IMPORT_BUDGET', 0.2))
+
+HEAVY_MODULES = ['jinja2', 'sass', 'markdown', 'arrow', 'magic', 'cchardet', 'yaml', 'http.server', 'tarfile']
+
+
+def _run_python(code):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.check_output([sys.executable, '-c', code], cwd=root).decode('ascii').strip()
+
+
+class TestPlugins(unittest.TestCase):
+    def test_lazy_attributes(self):
+        from breeze.plugins.templates import Jinja2
+
+        self.assertIs(Jinja2, breeze.plugins.Jinja2)
+        self.assertTrue(set(breeze.plugins.__all__) <= set(dir(breeze.plugins)))
+        with self.assertRaises(AttributeError):
+            breeze.plugins.Missing
+
+    @unittest.skipIf(sys.version_info < (3, 7), "Plugins are imported eagerly without PEP 562")
+    def test_lazy_imports(self):
+        loaded = _run_python(
+            'import sys, breeze.plugins; '
+            'from breeze.plugins import Contents, Jinja2, Markdown, Sass, Data, Blog; '
+            'Contents(); Jinja2(); Markdown(); Data(); Blog("*", "{{slug}}"); '
+            'print(",".join(m for m in {!r} if m in sys.modules))'.format(HEAVY_MODULES)
+        )
+        self.assertEqual('', loaded)
+
+    def test_eager_imports(self):
+        # Without PEP 562, every plugin is imported along with breeze.plugins, which must not be circular
+        for module in ('breeze', 'breeze.plugins'):
+            loaded = _run_python(
+                'import sys; sys.version_info = (3, 6, 0); import {}, breeze.plugins; '
+                'print(",".join(name for name in breeze.plugins.__all__ if name in vars(breeze.plugins)))'.format(module)
+            )
+            self.assertEqual(','.join(breeze.plugins.__all__), loaded)
+
+    def test_import_time(self):
+        code = 'import time; t = time.time(); import breeze.plugins; print(time.time() - t)'
+        elapsed = min(float(_run_python(code)) for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+    def test_registry(self):
+        class Entry(object):
+            def __init__(self, value):
+                self.value = value
+                self.loaded = False
+
+            def load(self):
+                self.loaded = True
+                return self.value
+
+        thumbnails = Entry(object())
+        entry_points = [
+            PluginSpec('Thumbnails', 'breeze_thumbnails', 'Thumbnails', 'breeze-thumbnails', thumbnails),
+            PluginSpec('Markdown', 'other', 'Markdown', 'other', Entry(None)),
+        ]
+        self.addCleanup(plugin_registry, refresh=True)
+        with mock.patch('breeze.plugins._entry_points', new=mock.Mock(return_value=entry_points)):
+            registry = plugin_registry(refresh=True)
+
+        self.assertEqual(breeze.plugins.__all__ + ['Thumbnails'], list(registry))
+        self.assertEqual(('breeze.plugins.templates', 'Markdown'), (registry['Markdown'].module, registry['Markdown'].attr))
+        self.assertFalse(thumbnails.loaded)
+        self.assertIs(thumbnails.value, load_plugin('Thumbnails'))
+        self.assertIs(breeze.plugins.Markdown, load_plugin('Markdown'))
+        with self.assertRaises(ValueError):
+            load_plugin('Missing')
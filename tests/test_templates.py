@@ -1,8 +1,15 @@
 import unittest
 import textwrap
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
 
+import breeze.plugins.templates
 from breeze.plugins.templates import Jinja2, Markdown, Sass, HTML
-from . import MockBreeze
+from breeze import InDirectory
+from breeze.cache import Cache
+from . import MockAttr, MockBreeze
 
 
 class TestJinja2(unittest.TestCase):
@@ -34,6 +41,280 @@ class TestJinja2(unittest.TestCase):
         )
 
 
+    def test_jinja2__cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def files(contents):
+            return {
+                'partial.jinja.html': {'destination': 'partial.jinja.html', 'skip_render': True, '_contents': contents},
+                'page.jinja.html': {'destination': 'page.jinja.html', '_contents': 'page {% include "partial.jinja.html" %}'},
+            }
+
+        p = Jinja2()
+        b = MockBreeze(files=files('partial {{ 1 }}'), config={'cache_directory': directory}, cache=Cache(directory))
+        p.run(b)
+        self.assertEqual(u'page partial 1', b.files['page.jinja.html']['_contents'])
+        self.assertEqual(['jinja2', 'jinja2'], [namespace for namespace, _, _, _, _ in b.cache.entries()])
+        template = p.environment.get_template('partial.jinja.html')
+
+        # The bytecode is reused by a new environment, even with the cache moved elsewhere
+        moved = os.path.join(directory, 'moved')
+        shutil.copytree(os.path.join(directory, 'jinja2'), os.path.join(moved, 'jinja2'))
+        p2 = Jinja2()
+        b2 = MockBreeze(files=files('partial {{ 1 }}'), cache=Cache(moved))
+        p2.run(b2)
+        self.assertEqual(u'page partial 1', b2.files['page.jinja.html']['_contents'])
+        self.assertEqual({'jinja2': {'hits': 2, 'remote_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}}, b2.cache.stats)
+
+        b.files = files('partial {{ 1 }}')
+        p.run(b)
+        self.assertEqual(u'page partial 1', b.files['page.jinja.html']['_contents'])
+        self.assertIs(template, p.environment.get_template('partial.jinja.html'))
+
+        b.files = files('partial {{ 2 }}')
+        p.run(b)
+        self.assertEqual(u'page partial 2', b.files['page.jinja.html']['_contents'])
+        self.assertIsNot(template, p.environment.get_template('partial.jinja.html'))
+
+    def test_jinja2__no_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        p = Jinja2(bytecode_cache=False)
+        b = MockBreeze(files={
+            'page.jinja.html': {'destination': 'page.jinja.html', '_contents': 'page'},
+        }, config={'cache_directory': directory}, cache=Cache(directory))
+        p.run(b)
+        self.assertEqual(u'page', b.files['page.jinja.html']['_contents'])
+        self.assertIsNone(p.environment.bytecode_cache)
+        self.assertEqual([], b.cache.entries())
+
+
+    def test_jinja2__selected(self):
+        p = Jinja2()
+        b = MockBreeze(files={
+            'a.jinja.html': {'destination': 'a.jinja.html', '_contents': 'a {{ 1 }}'},
+            'b.jinja.html': {'destination': 'b.jinja.html', '_contents': 'b {{ 1 }}'},
+            'c.txt': {'destination': 'c.txt', 'jinja_template': 'a.jinja.html', '_contents': ''},
+        }, selected=lambda filename: filename != 'b.jinja.html')
+        p.run(b)
+        self.assertEqual(u'a 1', b.files['a.jinja.html']['_contents'])
+        self.assertEqual({'destination': 'b.html', '_contents': 'b {{ 1 }}'}, b.files['b.jinja.html'])
+        self.assertEqual(u'a 1', b.files['c.txt']['_contents'])
+
+    def test_jinja2__context(self):
+        p = Jinja2()
+        b = MockBreeze(files={
+            'page.jinja.html': {
+                'destination': 'page.jinja.html',
+                'title': 'file',
+                '_contents': '{{ title }} {{ site }} {{ files|length }} {% set site = "set" %}{{ site }} {{ now is defined }}',
+            },
+            'include.jinja.html': {
+                'destination': 'include.jinja.html',
+                '_contents': '{% set x = 1 %}{% include "partial.html" %}',
+            },
+            'partial.html': {'destination': 'partial.html', 'skip_render': True, '_contents': '{{ x }} {{ site }}'},
+        }, context={'title': 'context', 'site': 'context'})
+        p.run(b)
+
+        self.assertEqual(u'file context 3 set True', b.files['page.jinja.html']['_contents'])
+        self.assertEqual(u'1 context', b.files['include.jinja.html']['_contents'])
+        self.assertEqual({'title': 'context', 'site': 'context'}, b.context)
+
+    def dependency_fixture(self):
+        return {
+            'base.jinja.html': {'destination': 'base.jinja.html', 'skip_render': True, '_contents': 'base {% block main %}{% endblock %}'},
+            'partial.jinja.html': {'destination': 'partial.jinja.html', 'skip_render': True, '_contents': 'partial'},
+            'macros.jinja.html': {'destination': 'macros.jinja.html', 'skip_render': True, '_contents': '{% macro m() %}m{% endmacro %}'},
+            'post.jinja.html': {'destination': 'post.jinja.html', 'skip_render': True, '_contents': '{% extends "base.jinja.html" %}{% block main %}{% include "partial.jinja.html" %}{{ _contents }}{% endblock %}'},
+            'page.jinja.html': {'destination': 'page.jinja.html', '_contents': '{% import "macros.jinja.html" as x %}{{ x.m() }}'},
+            'dynamic.jinja.html': {'destination': 'dynamic.jinja.html', '_contents': '{% include name %}', 'name': 'partial.jinja.html'},
+            'post.md': {'destination': 'post.md', 'jinja_template': 'post.jinja.html', '_contents': 'post'},
+        }
+
+    def test_jinja2__dependencies(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        p = Jinja2()
+        b = MockBreeze(files=self.dependency_fixture(), config={'cache_directory': directory})
+        p.run(b)
+
+        expected = {
+            'page.jinja.html': ['macros.jinja.html', 'page.jinja.html'],
+            'dynamic.jinja.html': ['*', 'dynamic.jinja.html'],
+            'post.md': ['base.jinja.html', 'partial.jinja.html', 'post.jinja.html'],
+        }
+        self.assertEqual(expected, p.dependencies)
+        self.assertEqual(['dynamic.jinja.html', 'post.md'], p.dependents(['partial.jinja.html']))
+        self.assertEqual(['dynamic.jinja.html', 'page.jinja.html'], p.dependents(['macros.jinja.html']))
+
+        p2 = Jinja2()
+        p2.breeze_instance = b
+        self.assertEqual(expected, p2.load_dependencies())
+        self.assertEqual(['dynamic.jinja.html', 'post.md'], p2.dependents(['base.jinja.html']))
+
+    def test_jinja2__dependencies_shards(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config = {'cache_directory': directory}
+
+        p = Jinja2()
+        p.run(MockBreeze(files=self.dependency_fixture(), config=config))
+        expected = dict(p.dependencies)
+
+        # Each shard saves what it rendered, without overwriting what the others saved
+        shards = {1: ['post.md'], 2: ['page.jinja.html', 'dynamic.jinja.html']}
+        for index, filenames in shards.items():
+            files = self.dependency_fixture()
+            files['post.jinja.html']['_contents'] += '{% include "macros.jinja.html" %}'
+            b = MockBreeze(files=files, config=config, shard=(index, 2), selected=lambda filename: filename in filenames)
+            Jinja2().run(b)
+        self.assertEqual(expected, p.load_dependencies())
+
+        p2 = Jinja2()
+        p2.merge_shards(b, 2)
+        expected['post.md'] = ['base.jinja.html', 'macros.jinja.html', 'partial.jinja.html', 'post.jinja.html']
+        self.assertEqual(expected, p2.dependencies)
+        self.assertEqual(expected, p2.load_dependencies())
+        self.assertEqual(['jinja2-dependencies.json'], os.listdir(directory))
+
+    def test_jinja2__incremental(self):
+        p = Jinja2(incremental=True)
+        b = MockBreeze(files=self.dependency_fixture(), context={'title': 'a'})
+        p.run(b)
+        self.assertEqual(u'base partialpost', b.files['post.md']['_contents'])
+
+        renders = []
+        render = p._render_template
+
+        def _mock_render(name, file_data):
+            renders.append(name)
+            return render(name, file_data)
+
+        with MockAttr(p, _render_template=_mock_render):
+            b.files = self.dependency_fixture()
+            p.run(b)
+            self.assertEqual(['dynamic.jinja.html'], renders)
+            self.assertEqual(u'base partialpost', b.files['post.md']['_contents'])
+
+            del renders[:]
+            b.files = self.dependency_fixture()
+            b.files['partial.jinja.html']['_contents'] = 'changed'
+            p.run(b)
+            self.assertEqual(['dynamic.jinja.html', 'post.jinja.html'], renders)
+            self.assertEqual(u'base changedpost', b.files['post.md']['_contents'])
+
+            del renders[:]
+            b.files = self.dependency_fixture()
+            b.files['post.md']['_contents'] = 'changed'
+            p.run(b)
+            self.assertEqual(['dynamic.jinja.html', 'post.jinja.html'], renders)
+
+            del renders[:]
+            b.files = self.dependency_fixture()
+            b.context['title'] = 'b'
+            p.run(b)
+            self.assertEqual(['page.jinja.html', 'dynamic.jinja.html', 'post.jinja.html'], renders)
+
+    def test_jinja2__incremental_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        p = Jinja2(incremental=True)
+        b = MockBreeze(files=self.dependency_fixture(), config={'cache_directory': directory}, cache=Cache(directory))
+        p.run(b)
+
+        # A new instance, as in a later build, reuses the output kept in the cache and the saved dependency graph
+        renders = []
+        p2 = Jinja2(incremental=True)
+        render = p2._render_template
+
+        def _mock_render(name, file_data):
+            renders.append(name)
+            return render(name, file_data)
+
+        b2 = MockBreeze(files=self.dependency_fixture(), config={'cache_directory': directory}, cache=Cache(directory))
+        with MockAttr(p2, _render_template=_mock_render):
+            p2.run(b2)
+        self.assertEqual(['dynamic.jinja.html'], renders)
+        self.assertEqual(u'base partialpost', b2.files['post.md']['_contents'])
+        self.assertEqual(u'm', b2.files['page.jinja.html']['_contents'])
+        self.assertEqual(p.dependencies, p2.dependencies)
+
+        # Files that are not selected keep their dependencies from the earlier build
+        p3 = Jinja2(incremental=True)
+        b3 = MockBreeze(
+            files=self.dependency_fixture(),
+            config={'cache_directory': directory},
+            cache=Cache(directory),
+            selected=lambda filename: filename == 'page.jinja.html',
+        )
+        p3.run(b3)
+        self.assertEqual(p.dependencies, p3.dependencies)
+        self.assertEqual(p.dependencies, p3.load_dependencies())
+
+
+    def test_jinja2__processes(self):
+        files = self.dependency_fixture()
+        for i in range(20):
+            files['post{}.md'.format(i)] = {'destination': 'post{}.md'.format(i), 'jinja_template': 'post.jinja.html', '_contents': str(i)}
+
+        serial = MockBreeze(files=dict((k, dict(v)) for k, v in files.items()))
+        Jinja2().run(serial)
+        parallel = MockBreeze(files=dict((k, dict(v)) for k, v in files.items()))
+        p = Jinja2(processes=2, chunk_size=3)
+        p.run(parallel)
+
+        self.assertEqual(serial.files, parallel.files)
+        self.assertEqual(u'base partial7', parallel.files['post7.md']['_contents'])
+        self.assertEqual(
+            {'base.jinja.html', 'partial.jinja.html', 'post.jinja.html'},
+            set(p.dependencies['post7.md'])
+        )
+
+    def test_jinja2__processes_error(self):
+        p = Jinja2(processes=2)
+        b = MockBreeze(files={
+            'a.jinja.html': {'destination': 'a.jinja.html', '_contents': 'a'},
+            'b.jinja.html': {'destination': 'b.jinja.html', '_contents': '{{ 1 / 0 }}'},
+        })
+        with self.assertRaises(RuntimeError) as e:
+            p.run(b)
+        self.assertIn('b.jinja.html', str(e.exception))
+        self.assertIn('ZeroDivisionError', str(e.exception))
+
+
+    def test_jinja2__compile_templates(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        b = MockBreeze(files=self.dependency_fixture(), config={'cache_directory': directory})
+        self.assertEqual(
+            ['base.jinja.html', 'dynamic.jinja.html', 'macros.jinja.html', 'page.jinja.html', 'partial.jinja.html', 'post.jinja.html'],
+            Jinja2(bytecode_cache=False).compile_templates(b)
+        )
+        self.assertTrue(os.path.exists(os.path.join(directory, 'jinja2-modules', 'index.json')))
+
+        p = Jinja2(bytecode_cache=False)
+        p.run(b)
+        self.assertEqual(u'base partialpost', b.files['post.md']['_contents'])
+        self.assertTrue(p.environment.get_template('post.jinja.html').filename.endswith('.py'))
+
+        b.files = self.dependency_fixture()
+        b.files['partial.jinja.html']['_contents'] = 'changed'
+        p.run(b)
+        self.assertEqual(u'base changedpost', b.files['post.md']['_contents'])
+        self.assertEqual('partial.jinja.html', p.environment.get_template('partial.jinja.html').filename)
+        self.assertTrue(p.environment.get_template('post.jinja.html').filename.endswith('.py'))
+
+    def test_jinja2__compile_templates__no_cache(self):
+        with self.assertRaises(ValueError):
+            Jinja2().compile_templates(MockBreeze(files=self.dependency_fixture()))
+
+
 class TestMarkdown(unittest.TestCase):
     def test_markdown(self):
         p = Markdown()
@@ -111,6 +392,72 @@ class TestMarkdown(unittest.TestCase):
             b.files
         )
 
+    def test_markdown__converter(self):
+        p = Markdown(extensions=['footnotes'])
+        b = MockBreeze(files=OrderedDict([
+            ('a.md', {'destination': 'a.md', '_contents': 'a[^1]\n\n[^1]: note\n'}),
+            ('b.md', {'destination': 'b.md', '_contents': 'b\n'}),
+        ]))
+        p.run(b)
+
+        # The footnote would be repeated in the second file if the converter were not reset
+        self.assertIn(u'note', b.files['a.md']['_contents'])
+        self.assertEqual(u'<p>b</p>', b.files['b.md']['_contents'])
+
+    def test_markdown__cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        p = Markdown()
+        b = MockBreeze(files={'a.md': {'destination': 'a.md', '_contents': '# foo\n'}}, cache=Cache(directory))
+        p.run(b)
+        self.assertEqual(u'<h1>foo</h1>', b.files['a.md']['_contents'])
+        self.assertEqual(1, len(b.cache.entries()))
+
+        def _mock_convert(text):
+            raise AssertionError("Converted a cached file")
+
+        p = Markdown()
+        b.files = {'a.md': {'destination': 'a.md', '_contents': '# foo\n'}}
+        with MockAttr(p, convert=_mock_convert):
+            p.run(b)
+        self.assertEqual(u'<h1>foo</h1>', b.files['a.md']['_contents'])
+
+        p = Markdown(output_format='html')
+        b.files = {'a.md': {'destination': 'a.md', '_contents': '# foo\n'}}
+        p.run(b)
+        self.assertEqual(2, len(b.cache.entries()))
+        self.assertEqual({'markdown': {'hits': 1, 'remote_hits': 0, 'misses': 2, 'writes': 2, 'evictions': 0}}, b.cache.stats)
+
+
+    def test_markdown__cache_extensions(self):
+        from markdown.extensions.toc import TocExtension
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        p = Markdown(extensions=[TocExtension(), 'footnotes'])
+        b = MockBreeze(files={'a.md': {'destination': 'a.md', '_contents': '# foo\n'}}, cache=Cache(directory))
+        p.run(b)
+        self.assertEqual(u'<h1 id="foo">foo</h1>', b.files['a.md']['_contents'])
+
+        # Another instance of the same extension, with the same configuration, gives the same key
+        p = Markdown(extensions=[TocExtension(), 'footnotes'])
+        b.files = {'a.md': {'destination': 'a.md', '_contents': '# foo\n'}}
+        p.run(b)
+        self.assertEqual(1, len(b.cache.entries()))
+
+        p = Markdown(extensions=[TocExtension(separator='_'), 'footnotes'])
+        b.files = {'a.md': {'destination': 'a.md', '_contents': '# foo\n'}}
+        p.run(b)
+        self.assertEqual(2, len(b.cache.entries()))
+        self.assertEqual({'markdown': {'hits': 1, 'remote_hits': 0, 'misses': 2, 'writes': 2, 'evictions': 0}}, b.cache.stats)
+
+        p = Markdown(extensions=[object()])
+        b.files = {'a.md': {'destination': 'a.md', '_contents': '# foo\n'}}
+        with self.assertRaises(ValueError):
+            p.run(b)
+
 
 class TestSass(unittest.TestCase):
     def test_sass(self):
@@ -137,6 +484,114 @@ class TestSass(unittest.TestCase):
             b.files
         )
 
+    def sass_fixture(self, included='.bar {color: blue;}\n'):
+        return {
+            'scss/main.scss': {'destination': 'scss/main.scss', '_contents': '@import "included";\n.foo {color: red;}\n'},
+            'scss/other.scss': {'destination': 'scss/other.scss', '_contents': '@import "lib/colors", "print.css";\n'},
+            'scss/_included.scss': {'destination': 'scss/_included.scss', '_contents': included},
+            'scss/lib/_colors.scss': {'destination': 'scss/lib/_colors.scss', '_contents': '$color: green;\n'},
+        }
+
+    def in_tempdir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        in_directory = InDirectory(directory)
+        in_directory.__enter__()
+        self.addCleanup(in_directory.__exit__, None, None, None)
+        return directory
+
+    def test_sass__dependencies(self):
+        self.in_tempdir()
+        p = Sass('scss', output_style='compressed')
+        b = MockBreeze(files=self.sass_fixture())
+        b.files['scss/other.scss']['_contents'] = '@import "lib/colors", "print.css";\n.baz {color: $color;}\n'
+        b.files['scss/lib/_colors.scss']['_contents'] = '@import "../included";\n$color: green;\n'
+        # Partials not in the file list are read from disk
+        os.makedirs('scss')
+        with open('scss/_included.scss', 'w') as fp:
+            fp.write(b.files.pop('scss/_included.scss')['_contents'])
+        b.files['print/print.scss'] = {'destination': 'print/print.scss', '_contents': '@import "../scss/included", "missing";'}
+        p.run(b)
+
+        self.assertEqual(['print/print.scss', 'scss/main.scss', 'scss/other.scss'], sorted(b.files.keys()))
+        self.assertEqual(u'.bar{color:blue}.foo{color:red}\n', b.files['scss/main.scss']['_contents'])
+        self.assertEqual(u'@import url(print.css);.bar{color:blue}.baz{color:green}\n', b.files['scss/other.scss']['_contents'])
+        self.assertEqual(
+            {
+                'scss/main.scss': ['scss/_included.scss'],
+                'scss/other.scss': ['scss/lib/_colors.scss', 'scss/_included.scss'],
+            },
+            p.dependencies
+        )
+        self.assertEqual(
+            ['print/print.scss', 'scss/_included.scss', 'print/missing'],
+            list(p.sources('print/print.scss').keys())
+        )
+        self.assertIsNone(p.sources('print/print.scss')['print/missing'])
+        self.assertEqual(['lib/colors'], Sass.imports('@import "lib/colors", "print.css", url(foo.css);'))
+        self.assertEqual(
+            ('scss/_included.scss', u'.bar {color: blue;}\n'),
+            p.resolve('../included', 'scss/lib/_colors.scss')
+        )
+        self.assertEqual((None, None), p.resolve('missing', 'scss/main.scss'))
+
+    def test_sass__importer(self):
+        p = Sass('scss', output_style='compressed')
+        b = MockBreeze(files=self.sass_fixture(), cache=Cache())
+        b.files['scss/other.scss']['_contents'] = '@import "lib/colors";\n.baz {color: $color;}\n'
+        b.files['scss/lib/_colors.scss']['_contents'] = '@import "../included";\n$color: blue;\n'
+        with MockAttr(os.path, isfile=lambda path: self.fail("Read an import from disk: " + path)):
+            p.run(b)
+
+        self.assertEqual(u'.bar{color:blue}.foo{color:red}\n', b.files['scss/main.scss']['_contents'])
+        self.assertEqual(u'.bar{color:blue}.baz{color:blue}\n', b.files['scss/other.scss']['_contents'])
+
+    def test_sass__cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        compiled = []
+        _sass_compile = breeze.plugins.templates._sass_compile
+        def _mock_compile(job):
+            compiled.append(job['string'])
+            return _sass_compile(job)
+
+        p = Sass('scss', output_style='compressed')
+        b = MockBreeze(files=self.sass_fixture(), cache=Cache(directory))
+        with MockAttr(breeze.plugins.templates, _sass_compile=_mock_compile):
+            p.run(b)
+            self.assertEqual(2, len(compiled))
+
+            b.files = self.sass_fixture()
+            p.run(b)
+            self.assertEqual(u'.bar{color:blue}.foo{color:red}\n', b.files['scss/main.scss']['_contents'])
+            self.assertEqual(2, len(compiled))
+
+            b.files = self.sass_fixture(included='.bar {color: green;}\n')
+            p.run(b)
+            self.assertEqual(u'.bar{color:green}.foo{color:red}\n', b.files['scss/main.scss']['_contents'])
+            self.assertEqual(['@import "included";\n.foo {color: red;}\n'], compiled[2:])
+
+            p.output_style = 'expanded'
+            b.files = self.sass_fixture(included='.bar {color: green;}\n')
+            p.run(b)
+            self.assertEqual(5, len(compiled))
+
+            # The key does not depend on the working directory, so the cache may be shared by checkouts elsewhere
+            with InDirectory(directory):
+                b.files = self.sass_fixture(included='.bar {color: green;}\n')
+                p.run(b)
+            self.assertEqual(u'.bar {\n  color: green;\n}\n\n.foo {\n  color: red;\n}\n', b.files['scss/main.scss']['_contents'])
+            self.assertEqual(5, len(compiled))
+
+    def test_sass__processes(self):
+        p = Sass('scss', output_style='compressed', processes=2)
+        b = MockBreeze(files=self.sass_fixture(), cache=Cache())
+        b.files['scss/other.scss']['_contents'] = '.baz {color: green;}\n'
+        p.run(b)
+
+        self.assertEqual(u'.bar{color:blue}.foo{color:red}\n', b.files['scss/main.scss']['_contents'])
+        self.assertEqual(u'.baz{color:green}\n', b.files['scss/other.scss']['_contents'])
+
 
 class TestHTML(unittest.TestCase):
     maxDiff = None
@@ -561,3 +1016,12 @@ class TestHTML(unittest.TestCase):
             },
             b.files
         )
+
+    def test_line_breaks(self):
+        p = HTML(create_paragraphs=True, convert_indentation='first', nl_to_br=True)
+
+        # Any two line break characters separate paragraphs, including "\r\n"
+        self.assertEqual(
+            u'<p></p>\n\n<p>&nbsp;&nbsp;a<br />\n  b</p>\n\n<p>&nbsp;c<br />\n \x0c</p>\n\n<p></p>',
+            p.transform(u'\r\r  a\n  b\r\n \x0c c\r \x0c\n\n')
+        )